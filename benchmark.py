@@ -0,0 +1,258 @@
+##############################################################
+# Stage benchmarks of create_cltv_p on synthetic transactions
+##############################################################
+
+# Times every stage of the pipeline (load, clean, RFM, BG/NBD fit, Gamma-Gamma
+# fit, predict, CLV, segment) on synthetic.py data of increasing size and writes
+# a JSON report. Passing an earlier report as --baseline lists the stages that
+# got slower than the tolerance and exits with status 1. --scoring times
+# cltv.score_profiles in float64 and float32 on synthetic customer summaries and
+# reports the float32 error.
+#
+#   python benchmark.py --lines 10000 100000 1000000 --output bench.json
+#   python benchmark.py --lines 10000 100000 1000000 --baseline bench.json
+#   python benchmark.py --lines --scoring 1000000 10000000 50000000
+
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from cltv import fit_cltv_model, score_cltv, score_profiles
+from ingest import PIPELINE_COLUMNS
+from instrumentation import Profiler
+from model_store import CLTVModel
+from preprocessing import (OUTLIER_VARIABLES, clean_chunk, outlier_thresholds, replace_with_thresholds, valid_rows,
+                           valid_thresholds)
+from rfm import TODAY_DATE, rfm_summary
+from synthetic import BGNBD_PARAMS, GAMMA_GAMMA_PARAMS, synthetic_profiles, write_synthetic_transactions
+
+
+def run_pipeline(path, profiler, month=3, today_date=TODAY_DATE):
+    """create_cltv_p on a Parquet file; every stage is recorded in profiler."""
+    with profiler.stage("load") as info:
+        dataframe = pd.read_parquet(path, columns=PIPELINE_COLUMNS)
+        info["rows_out"] = len(dataframe)
+
+    with profiler.stage("clean") as info:
+        mask = valid_rows(dataframe)
+        thresholds = valid_thresholds(dataframe, mask)
+        cleaned = clean_chunk(dataframe, thresholds, mask)
+        info.update(rows_in=len(dataframe), rows_out=len(cleaned))
+    del dataframe
+
+    with profiler.stage("rfm") as info:
+        cltv_df = rfm_summary(cleaned, today_date)
+        info.update(rows_in=len(cleaned), rows_out=len(cltv_df))
+    del cleaned
+
+    model = fit_cltv_model(cltv_df, thresholds, profiler=profiler)
+    return score_cltv(cltv_df, model, month, profiler)
+
+
+def chained_clean(dataframe):
+    """The cleaning sequence create_cltv_p used before valid_rows/clean_chunk:
+    dropna on the caller's frame, four filtered copies, then column writes."""
+    dataframe.dropna(inplace=True)
+    dataframe = dataframe[~dataframe["Invoice"].str.contains("C", na=False)]
+    dataframe = dataframe[dataframe["Quantity"] > 0]
+    dataframe = dataframe[dataframe["Price"] > 0]
+    thresholds = {variable: outlier_thresholds(dataframe, variable) for variable in OUTLIER_VARIABLES}
+    replace_with_thresholds(dataframe, "Quantity", thresholds["Quantity"])
+    replace_with_thresholds(dataframe, "Price", thresholds["Price"])
+    dataframe["TotalPrice"] = dataframe["Quantity"] * dataframe["Price"]
+    return dataframe
+
+
+def masked_clean(dataframe):
+    mask = valid_rows(dataframe)
+    return clean_chunk(dataframe, valid_thresholds(dataframe, mask), mask)
+
+
+def benchmark_cleaning(path, repeat=3):
+    """Wall time and tracemalloc peak of chained_clean vs masked_clean on one file."""
+    dataframe = pd.read_parquet(path, columns=PIPELINE_COLUMNS)
+    results = {}
+    for name, clean in (("chained", chained_clean), ("masked", masked_clean)):
+        times = []
+        for _ in range(repeat):
+            # chained_clean drops rows of its input in place
+            frame = dataframe.copy()
+            started = time.perf_counter()
+            clean(frame)
+            times.append(time.perf_counter() - started)
+        frame = dataframe.copy()
+        tracemalloc.start()
+        clean(frame)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {"wall_s": min(times), "peak_alloc_mb": peak / 2 ** 20}
+    results["input_mb"] = dataframe.memory_usage(deep=True).sum() / 2 ** 20
+    return results
+
+
+def benchmark_scoring(n_customers, month=3, block_size=1_000_000, seed=0):
+    """score_profiles in float64 vs float32 on n_customers synthetic summaries,
+    block by block; scored with the true parameters of the generator (weekly units).
+    Errors are relative to the float64 results."""
+    model = CLTVModel([BGNBD_PARAMS["r"], BGNBD_PARAMS["alpha"] / 7, BGNBD_PARAMS["a"], BGNBD_PARAMS["b"]],
+                      [GAMMA_GAMMA_PARAMS[name] for name in ("p", "q", "v")])
+    wall = {"float64": 0.0, "float32": 0.0}
+    errors = {"clv": [0.0, 0.0], "expected_purchases": [0.0, 0.0]}
+    above = 0
+    for block, start in enumerate(range(0, n_customers, block_size)):
+        profiles = synthetic_profiles(min(block_size, n_customers - start), seed=seed + block)
+        scores = {}
+        for dtype in wall:
+            arrays = [profiles[col].astype(dtype) for col in ("frequency", "recency", "T", "monetary")]
+            started = time.perf_counter()
+            scores[dtype] = score_profiles(model, *arrays, month=month, dtype=dtype)
+            wall[dtype] += time.perf_counter() - started
+        for name, error in errors.items():
+            reference = scores["float64"][name]
+            relative = np.abs(scores["float32"][name] - reference) / np.maximum(np.abs(reference), 1e-12)
+            error[0] = max(error[0], float(relative.max()))
+            error[1] += float(relative.sum())
+            if name == "clv":
+                above += int((relative > 1e-4).sum())
+    result = {"n_customers": n_customers, "month": month,
+              "float64_s": wall["float64"], "float32_s": wall["float32"],
+              "speedup": wall["float64"] / wall["float32"],
+              "clv_above_1e-4": above}
+    for name, (maximum, total) in errors.items():
+        result[f"{name}_max_rel_error"] = maximum
+        result[f"{name}_mean_rel_error"] = total / (n_customers * (3 if name == "expected_purchases" else 1))
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(sizes, repeat=1, seed=0, trace_memory=False, data_dir=None, cleaning=False):
+    """One entry per size; wall/cpu times are the fastest of `repeat` runs."""
+    report = {"meta": {"created": dt.datetime.now().isoformat(timespec="seconds"),
+                       "commit": _git_commit(),
+                       "python": platform.python_version(),
+                       "numpy": np.__version__,
+                       "pandas": pd.__version__,
+                       "machine": platform.machine(),
+                       "cpus": os.cpu_count(),
+                       "seed": seed,
+                       "repeat": repeat,
+                       "trace_memory": trace_memory},
+              "runs": []}
+    with tempfile.TemporaryDirectory(dir=data_dir) as tmp:
+        for n_lines in sizes:
+            path = os.path.join(tmp, f"transactions_{n_lines}.parquet")
+            started = time.perf_counter()
+            write_synthetic_transactions(path, n_lines, seed=seed)
+            generate_s = time.perf_counter() - started
+
+            best = None
+            for _ in range(repeat):
+                profiler = Profiler({"n_lines": n_lines}, trace_memory)
+                run_pipeline(path, profiler)
+                stages = {record.pop("stage"): record for record in profiler.records}
+                if best is None:
+                    best = stages
+                else:
+                    for name, stage in stages.items():
+                        for key in ("wall_s", "cpu_s"):
+                            best[name][key] = min(best[name][key], stage[key])
+            run = {"n_lines": n_lines, "generate_s": generate_s, "stages": best,
+                   "total_wall_s": sum(stage["wall_s"] for stage in best.values())}
+            if cleaning:
+                run["cleaning"] = benchmark_cleaning(path, max(repeat, 3))
+            report["runs"].append(run)
+            print(format_run(run), flush=True)
+    return report
+
+
+def format_run(run):
+    lines = [f"{run['n_lines']:,} lines, total {run['total_wall_s']:.3f}s"]
+    for name, stage in run["stages"].items():
+        lines.append(f"  {name:<16}{stage['wall_s']:>10.4f}s  cpu {stage['cpu_s']:>8.4f}s  "
+                     f"rss +{stage['peak_rss_delta_mb']:>7.1f}MB  rows {stage.get('rows_out', '')}")
+    if "cleaning" in run:
+        for name in ("chained", "masked"):
+            lines.append(f"  clean/{name:<10}{run['cleaning'][name]['wall_s']:>10.4f}s  "
+                         f"peak {run['cleaning'][name]['peak_alloc_mb']:>8.1f}MB")
+    return "\n".join(lines)
+
+
+def compare_reports(baseline, report, tolerance=0.25, min_seconds=0.01):
+    """Stages whose wall time grew by more than `tolerance` (relative) against the
+    run of the same size in baseline; stages under min_seconds are ignored as noise."""
+    baseline_runs = {run["n_lines"]: run for run in baseline["runs"]}
+    regressions = []
+    for run in report["runs"]:
+        reference = baseline_runs.get(run["n_lines"])
+        if reference is None:
+            continue
+        for name, stage in run["stages"].items():
+            before = reference["stages"].get(name, {}).get("wall_s")
+            after = stage["wall_s"]
+            if before is None or max(before, after) < min_seconds:
+                continue
+            if after > before * (1 + tolerance):
+                regressions.append({"n_lines": run["n_lines"], "stage": name,
+                                    "baseline_s": before, "current_s": after, "ratio": after / before})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CLTV pipeline stage by stage.")
+    parser.add_argument("--lines", type=int, nargs="*", default=[10_000, 100_000, 1_000_000],
+                        help="pipeline sizes; pass --lines alone to skip the pipeline runs")
+    parser.add_argument("--scoring", type=int, nargs="+", metavar="CUSTOMERS",
+                        help="also compare float64 and float32 scoring at these customer counts")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="record peak allocations per stage with tracemalloc (slows the run)")
+    parser.add_argument("--cleaning", action="store_true",
+                        help="also compare the masked cleaning with the old chained filters")
+    parser.add_argument("--data-dir", help="where to write the generated transactions (default: system temp)")
+    parser.add_argument("--output", default="bench.json")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.lines, args.repeat, args.seed, args.trace_memory, args.data_dir, args.cleaning)
+    if args.scoring:
+        report["scoring"] = []
+        for n_customers in args.scoring:
+            result = benchmark_scoring(n_customers, seed=args.seed)
+            report["scoring"].append(result)
+            print(f"scoring {n_customers:,} customers: float64 {result['float64_s']:.2f}s, "
+                  f"float32 {result['float32_s']:.2f}s ({result['speedup']:.2f}x), "
+                  f"clv max rel error {result['clv_max_rel_error']:.1e}", flush=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare_reports(json.load(f), report, args.tolerance)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for regression in report.get("regressions", []):
+        print(f"REGRESSION {regression['stage']} at {regression['n_lines']:,} lines: "
+              f"{regression['baseline_s']:.4f}s -> {regression['current_s']:.4f}s "
+              f"({regression['ratio']:.2f}x)")
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,45 +11,34 @@
 
 import datetime as dt
 import pandas as pd
-import matplotlib.pyplot as plt
-from lifetimes import BetaGeoFitter
-from lifetimes import GammaGammaFitter
-from lifetimes.plotting import plot_period_transactions
 
 pd.set_option('display.max_columns', None)
 pd.set_option('display.width', 500)
 pd.set_option('display.float_format', lambda x: '%.4f' % x)
-from sklearn.preprocessing import MinMaxScaler
-
-
-def outlier_thresholds(dataframe, variable):
-    quartile1 = dataframe[variable].quantile(0.01)
-    quartile3 = dataframe[variable].quantile(0.99)
-    interquantile_range = quartile3 - quartile1
-    up_limit = quartile3 + 1.5 * interquantile_range
-    low_limit = quartile1 - 1.5 * interquantile_range
-    return low_limit, up_limit
-
 
-def replace_with_thresholds(dataframe, variable):
-    low_limit, up_limit = outlier_thresholds(dataframe, variable)
-    dataframe.loc[(dataframe[variable] < low_limit), variable] = low_limit
-    dataframe.loc[(dataframe[variable] > up_limit), variable] = up_limit
+# The pipeline itself lives in pipeline.py (also a command line tool); plotting,
+# scaling and the lifetimes fitters are imported below where the walkthrough uses them.
+from ingest import read_transactions
+from instrumentation import Profiler
+from pipeline import create_cltv_p, create_cltv_p_streaming
+from preprocessing import replace_with_thresholds
+from rfm import TODAY_DATE, rfm_summary
 
 
-
-df_ = pd.read_excel("datasets/online_retail_II.xlsx",
-                    sheet_name="Year 2009-2010")
+# The first run parses the workbook into datasets/.cache; later runs read only
+# the pipeline columns from Parquet.
+df_ = read_transactions("datasets/online_retail_II.xlsx",
+                        sheet_name="Year 2009-2010")
 df = df_.copy()
 
 df.head()
 """
-  Invoice StockCode                          Description  Quantity         InvoiceDate  Price  Customer ID         Country
-0  489434     85048  15CM CHRISTMAS GLASS BALL 20 LIGHTS        12 2009-12-01 07:45:00 6.9500   13085.0000  United Kingdom
-1  489434    79323P                   PINK CHERRY LIGHTS        12 2009-12-01 07:45:00 6.7500   13085.0000  United Kingdom
-2  489434    79323W                  WHITE CHERRY LIGHTS        12 2009-12-01 07:45:00 6.7500   13085.0000  United Kingdom
-3  489434     22041         RECORD FRAME 7" SINGLE SIZE         48 2009-12-01 07:45:00 2.1000   13085.0000  United Kingdom
-4  489434     21232       STRAWBERRY CERAMIC TRINKET BOX        24 2009-12-01 07:45:00 1.2500   13085.0000  United Kingdom
+  Invoice  Quantity  Price         InvoiceDate  Customer ID
+0  489434        12 6.9500 2009-12-01 07:45:00   13085.0000
+1  489434        12 6.7500 2009-12-01 07:45:00   13085.0000
+2  489434        12 6.7500 2009-12-01 07:45:00   13085.0000
+3  489434        48 2.1000 2009-12-01 07:45:00   13085.0000
+4  489434        24 1.2500 2009-12-01 07:45:00   13085.0000
 """
 
 #########################
@@ -68,7 +57,7 @@ replace_with_thresholds(df, "Price")
 
 df["TotalPrice"] = df["Quantity"] * df["Price"]
 
-today_date = dt.datetime(2011, 12, 11)
+today_date = TODAY_DATE
 
 
 #########################
@@ -81,33 +70,26 @@ today_date = dt.datetime(2011, 12, 11)
 # monetary_value:  Average earning per purchase
 
 
-cltv_df = df.groupby('Customer ID').agg({'InvoiceDate': [lambda date: (date.max() - date.min()).days,
-                                                         lambda date: (today_date - date.min()).days],
-                                         'Invoice': lambda num: num.nunique(),
-                                         'TotalPrice': lambda TotalPrice: TotalPrice.sum()})
+cltv_df = rfm_summary(df, today_date)
 
 cltv_df
 """
-            InvoiceDate             Invoice TotalPrice
-             <lambda_0> <lambda_1> <lambda>   <lambda>
-Customer ID                                           
-12346.0000          196        726       11   372.8600
-12347.0000           37        405        2  1323.3200
-12348.0000            0        439        1   222.1600
-12349.0000          181        590        3  2295.0200
-12351.0000            0        376        1   300.9300
-                 ...        ...      ...        ...
-18283.0000          275        659        6   641.7700
-18284.0000            0        432        1   448.6200
-18285.0000            0        661        1   413.9400
-18286.0000          247        724        2  1283.3700
-18287.0000          188        572        4  2332.6500
+             recency    T  frequency  monetary
+Customer ID                                   
+12346.0000       196  726         11  372.8600
+12347.0000        37  405          2 1323.3200
+12348.0000         0  439          1  222.1600
+12349.0000       181  590          3 2295.0200
+12351.0000         0  376          1  300.9300
+               ...  ...        ...       ...
+18283.0000       275  659          6  641.7700
+18284.0000         0  432          1  448.6200
+18285.0000         0  661          1  413.9400
+18286.0000       247  724          2 1283.3700
+18287.0000       188  572          4 2332.6500
 [4312 rows x 4 columns]
 """
 
-cltv_df.columns = cltv_df.columns.droplevel(0)
-cltv_df.columns = ['recency', 'T', 'frequency', 'monetary']
-
 
 cltv_df["monetary"] = cltv_df["monetary"] / cltv_df["frequency"]
 
@@ -140,6 +122,8 @@ Customer ID
 # 2. BG-NBD Model
 ##############################################################
 
+from lifetimes import BetaGeoFitter
+
 bgf = BetaGeoFitter(penalizer_coef=0.001)
 
 bgf.fit(cltv_df['frequency'],
@@ -279,14 +263,29 @@ bgf.predict(4 * 3,
 # Visualization of the prediction results.
 ################################################################
 
+import matplotlib.pyplot as plt
+from lifetimes.plotting import plot_period_transactions
+
 plot_period_transactions(bgf)
 plt.show()
 
+# The plot only compares in-sample frequencies. evaluation.py fits on the
+# transactions up to a cutoff and scores the weeks after it: MAE, RMSE and decile
+# lift of predicted vs actual purchases and revenue, for one or several cutoffs.
+# evaluation.sweep_cutoffs runs several cutoffs on a process pool, so call it from
+# a script with an `if __name__ == "__main__":` guard, not from this walkthrough.
+from evaluation import evaluate_holdout
+
+holdout_customers, holdout = evaluate_holdout(df, "2010-09-01")
+print(holdout["purchases"]["mae"], holdout["purchases"]["top_decile_lift"])
+
 ##############################################################
 # 3. GAMMA-GAMMA Model
 ##############################################################
 
 
+from lifetimes import GammaGammaFitter
+
 ggf = GammaGammaFitter(penalizer_coef=0.01)
 ggf.fit(cltv_df['frequency'], cltv_df['monetary'])
 
@@ -449,6 +448,8 @@ cltv_final.sort_values(by="clv", ascending=False).head(10)
 """
 
 
+from sklearn.preprocessing import MinMaxScaler
+
 scaler = MinMaxScaler(feature_range=(0, 1))
 scaler.fit(cltv_final[["clv"]])
 cltv_final["scaled_clv"] = scaler.transform(cltv_final[["clv"]])
@@ -472,6 +473,15 @@ cltv_final.sort_values(by="scaled_clv", ascending=False).head()
 
 cltv_final["segment"] = pd.qcut(cltv_final["scaled_clv"], 4, labels=["D", "C", "B", "A"])
 
+# The same segments and scaled_clv without the full column: segmentation.py
+# collects cut points and min / max chunk by chunk, and the frozen cuts can be
+# saved and reused to label later runs the same way.
+from segmentation import CLVSegmenter
+
+cuts = CLVSegmenter(method="exact").update(cltv_final["clv"]).freeze()
+cuts.save("segment_cuts.json")
+(cuts.segment(cltv_final["clv"]) == cltv_final["segment"]).all()
+
 cltv_final.head()
 """
    Customer ID  recency        T  frequency  monetary  expected_purc_1_week  expected_purc_1_month  expected_average_profit     clv  scaled_clv segment
@@ -555,71 +565,27 @@ A               723 15222.0069 11005511.0000     723 37.8453 27362.1429   723 95
 # 6. Function of the project
 ##############################################################
 
-def create_cltv_p(dataframe, month=3):
-    dataframe.dropna(inplace=True)
-    dataframe = dataframe[~dataframe["Invoice"].str.contains("C", na=False)]
-    dataframe = dataframe[dataframe["Quantity"] > 0]
-    dataframe = dataframe[dataframe["Price"] > 0]
-    replace_with_thresholds(dataframe, "Quantity")
-    replace_with_thresholds(dataframe, "Price")
-    dataframe["TotalPrice"] = dataframe["Quantity"] * dataframe["Price"]
-    today_date = dt.datetime(2011, 12, 11)
-
-    cltv_df = dataframe.groupby('Customer ID').agg(
-        {'InvoiceDate': [lambda InvoiceDate: (InvoiceDate.max() - InvoiceDate.min()).days,
-                         lambda InvoiceDate: (today_date - InvoiceDate.min()).days],
-         'Invoice': lambda Invoice: Invoice.nunique(),
-         'TotalPrice': lambda TotalPrice: TotalPrice.sum()})
-
-    cltv_df.columns = cltv_df.columns.droplevel(0)
-    cltv_df.columns = ['recency', 'T', 'frequency', 'monetary']
-    cltv_df["monetary"] = cltv_df["monetary"] / cltv_df["frequency"]
-    cltv_df = cltv_df[(cltv_df['frequency'] > 1)]
-    cltv_df["recency"] = cltv_df["recency"] / 7
-    cltv_df["T"] = cltv_df["T"] / 7
-
-    bgf = BetaGeoFitter(penalizer_coef=0.001)
-    bgf.fit(cltv_df['frequency'],
-            cltv_df['recency'],
-            cltv_df['T'])
-
-    cltv_df["expected_purc_1_week"] = bgf.predict(1,
-                                                  cltv_df['frequency'],
-                                                  cltv_df['recency'],
-                                                  cltv_df['T'])
-
-    cltv_df["expected_purc_1_month"] = bgf.predict(4,
-                                                   cltv_df['frequency'],
-                                                   cltv_df['recency'],
-                                                   cltv_df['T'])
-
-    cltv_df["expected_purc_3_month"] = bgf.predict(12,
-                                                   cltv_df['frequency'],
-                                                   cltv_df['recency'],
-                                                   cltv_df['T'])
-
-    ggf = GammaGammaFitter(penalizer_coef=0.01)
-    ggf.fit(cltv_df['frequency'], cltv_df['monetary'])
-    cltv_df["expected_average_profit"] = ggf.conditional_expected_average_profit(cltv_df['frequency'],
-                                                                                 cltv_df['monetary'])
-
-    cltv = ggf.customer_lifetime_value(bgf,
-                                       cltv_df['frequency'],
-                                       cltv_df['recency'],
-                                       cltv_df['T'],
-                                       cltv_df['monetary'],
-                                       time=month,  # 3 aylık
-                                       freq="W",  # T'nin frekans bilgisi.
-                                       discount_rate=0.01)
-
-    cltv = cltv.reset_index()
-    cltv_final = cltv_df.merge(cltv, on="Customer ID", how="left")
-    cltv_final["segment"] = pd.qcut(cltv_final["clv"], 4, labels=["D", "C", "B", "A"])
-
-    return cltv_final
+# create_cltv_p and friends are defined in pipeline.py, which is also the command
+# line entry point:
+#   python pipeline.py datasets/online_retail_II.xlsx --sheet "Year 2009-2010" --output cltv.csv
 
 df = df_.copy()
 
 
-cltv_final2 = create_cltv_p(df)
+cltv_final2 = create_cltv_p(df, model_path="cltv_model.json")
+
+# Same run with per-stage timings, memory and row counts.
+df = df_.copy()
+profiler = Profiler(labels={"sheet": "Year 2009-2010"})
+cltv_final2 = create_cltv_p(df, profiler=profiler)
+print(profiler.format())
+profiler.to_jsonl("cltv_runs.jsonl")
+
+# Scoring-only run against the saved model: no refit, same cleaning thresholds.
+df = df_.copy()
+cltv_final2 = create_cltv_p(df, model="cltv_model.json")
+
+# Same pipeline without holding the raw sheet in memory.
+cltv_final3 = create_cltv_p_streaming("datasets/online_retail_II.xlsx",
+                                      sheet_name="Year 2009-2010")
 
@@ -0,0 +1,212 @@
+##############################################################
+# BG/NBD fitter on NumPy arrays
+##############################################################
+
+# Drop-in for lifetimes.BetaGeoFitter: same likelihood, time scaling and L2
+# penalty, so the fitted (r, alpha, a, b) agree within optimizer tolerance. The
+# log-likelihood and its gradient are closed form and vectorized, and the solver
+# is L-BFGS-B on the log parameters, which can warm-start from a previous fit.
+# Fader, Hardie & Lee (2005), "Counting Your Customers the Easy Way".
+
+import math
+
+import numpy as np
+import pandas as pd
+from scipy.special import digamma, gammaln, hyp2f1
+
+PARAM_NAMES = ["r", "alpha", "a", "b"]
+LOG_PARAM_BOUNDS = [(np.log(1e-8), np.log(1e8))] * 4
+
+
+def negative_log_likelihood(log_params, freq, rec, T, weights, penalizer_coef):
+    """Penalized mean negative log-likelihood and its gradient w.r.t. log_params."""
+    params = np.exp(log_params)
+    r, alpha, a, b = params
+    repeat = freq > 0
+    b_x = b + np.maximum(freq, 1) - 1
+
+    A_1 = gammaln(r + freq) - gammaln(r) + r * np.log(alpha)
+    A_2 = gammaln(a + b) + gammaln(b + freq) - gammaln(b) - gammaln(a + b + freq)
+    A_3 = -(r + freq) * np.log(alpha + T)
+    A_4 = np.log(a) - np.log(b_x) - (r + freq) * np.log(alpha + rec)
+
+    max_A_3_A_4 = np.where(repeat, np.maximum(A_3, A_4), A_3)
+    e_3 = np.exp(A_3 - max_A_3_A_4)
+    e_4 = np.where(repeat, np.exp(A_4 - max_A_3_A_4), 0.0)
+    total = e_3 + e_4
+    ll = A_1 + A_2 + np.log(total) + max_A_3_A_4
+
+    # posterior weights of the "still alive at T" and "dropped out after t_x" branches
+    w_3 = e_3 / total
+    w_4 = e_4 / total
+    d_r = digamma(r + freq) - digamma(r) + np.log(alpha) - w_3 * np.log(alpha + T) - w_4 * np.log(alpha + rec)
+    d_alpha = r / alpha - (r + freq) * (w_3 / (alpha + T) + w_4 / (alpha + rec))
+    d_a = digamma(a + b) - digamma(a + b + freq) + w_4 / a
+    d_b = digamma(a + b) + digamma(b + freq) - digamma(b) - digamma(a + b + freq) - w_4 / b_x
+
+    total_weight = weights.sum()
+    value = -(weights * ll).sum() / total_weight + penalizer_coef * (params ** 2).sum()
+    grad = np.array([-(weights * d).sum() / total_weight for d in (d_r, d_alpha, d_a, d_b)])
+    grad += 2 * penalizer_coef * params
+    return value, grad * params
+
+
+def conditional_expected_number_of_purchases_up_to_time(params, t, frequency, recency, T):
+    """Equation (10) of Fader, Hardie & Lee (2005), broadcasting over t and customers."""
+    r, alpha, a, b = params
+    x = frequency
+    _a = r + x
+    _b = b + x
+    _c = a + b + x - 1
+    _z = t / (alpha + T + t)
+    with np.errstate(divide="ignore"):
+        ln_hyp_term = np.log(hyp2f1(_a, _b, _c, _z))
+    # Same fallback as lifetimes when the direct series overflows, but only
+    # evaluated where it is needed.
+    overflow = np.isinf(ln_hyp_term)
+    if overflow.any():
+        _a, _b, _c, _z = (np.broadcast_to(v, ln_hyp_term.shape)[overflow] for v in (_a, _b, _c, _z))
+        ln_hyp_term[overflow] = np.log(hyp2f1(_c - _a, _c - _b, _c, _z)) + (_c - _a - _b) * np.log(1 - _z)
+    first_term = (a + b + x - 1) / (a - 1)
+    second_term = 1 - np.exp(ln_hyp_term + (r + x) * np.log((alpha + T) / (alpha + t + T)))
+    numerator = first_term * second_term
+    denominator = 1 + (x > 0) * (a / (b + np.maximum(x, 1) - 1)) * ((alpha + T) / (alpha + recency)) ** (r + x)
+    return numerator / denominator
+
+
+def conditional_expected_number_of_purchases_float32(params, t, frequency, recency, T, max_terms=1000):
+    """Equation (10) in float32 (the dtype of the arrays), without scipy's float64 hyp2f1.
+    t: (1, h) horizons; frequency, recency, T: (n, 1) customers.
+
+    By Euler's transformation (1 - z) ** (r + x) * 2F1(r + x, b + x; c; z) equals
+    (1 - z) ** (a - 1) * 2F1(a + b - 1 - r, a - 1; c; z), c = a + b + x - 1. The
+    terms of that series are bounded by z ** k and decay like k ** -(r + x + 2 - a),
+    so it is summed directly until the largest term is below half an ulp of 1;
+    customers whose terms got there leave the loop. 1 - (1 - z) ** (a - 1) comes
+    from expm1 / log1p and the P(alive) odds are kept in log space, so no power of
+    (alpha + T) / (alpha + recency) overflows.
+    """
+    r, alpha, a, b = (float(v) for v in params)
+    x = frequency
+    z = t / (alpha + T + t)
+    c = a + b + x - 1
+
+    series = np.zeros(z.shape, dtype=z.dtype)
+    tolerance = np.finfo(z.dtype).eps / 2
+    # a customer's terms are largest at the longest horizon
+    widest = int(np.argmax(t[0]))
+    rows = np.arange(len(z))
+    row_z, row_c = z, c
+    term = np.ones_like(z)
+    partial = np.zeros_like(z)
+    for k in range(max_terms):
+        scale = (a + b - 1 - r + k) * (a - 1 + k) / (k + 1)
+        if scale == 0:
+            break
+        term *= row_z
+        term /= (row_c + k) / scale
+        partial += term
+        if k % 8 == 7:
+            active = np.abs(term[:, widest]) > tolerance
+            n_active = np.count_nonzero(active)
+            if n_active == 0:
+                break
+            if n_active < 0.75 * len(rows):
+                series[rows[~active]] = partial[~active]
+                rows, row_z, row_c, term, partial = (v[active] for v in (rows, row_z, row_c, term, partial))
+    series[rows] = partial
+
+    log_survival = (a - 1) * np.log1p(-z)
+    second_term = -np.expm1(log_survival) - np.exp(log_survival) * series
+    numerator = c / (a - 1) * second_term
+    log_odds = (math.log(a) - np.log(b + np.maximum(x, 1) - 1)
+                + (r + x) * (np.log(alpha + T) - np.log(alpha + recency)))
+    log_odds = np.where(x > 0, log_odds, -np.inf)
+    return numerator * np.exp(-np.logaddexp(0, log_odds))
+
+
+def expected_purchases_by_horizon(params, horizons, frequency, recency, T, dtype="float64"):
+    """customers x horizons matrix of expected purchases in one pass.
+
+    The per-customer terms (first term, P(alive) denominator) are computed once on
+    (n, 1) arrays and broadcast against the (1, h) horizons.
+    dtype="float32" evaluates in single precision with
+    conditional_expected_number_of_purchases_float32.
+    """
+    horizons = np.asarray(horizons, dtype=dtype).reshape(1, -1)
+    frequency, recency, T = (np.asarray(v, dtype=dtype).reshape(-1, 1) for v in (frequency, recency, T))
+    if horizons.dtype == np.float32:
+        return conditional_expected_number_of_purchases_float32(params, horizons, frequency, recency, T)
+    return conditional_expected_number_of_purchases_up_to_time(params, horizons, frequency, recency, T)
+
+
+def _like(values, reference):
+    if isinstance(reference, pd.Series):
+        return pd.Series(values, index=reference.index)
+    return values
+
+
+class BGNBDFitter:
+    """BG/NBD model with the lifetimes.BetaGeoFitter interface used in this project.
+
+    initial_params: (r, alpha, a, b) in natural units, e.g. yesterday's params_, to
+    warm-start the solver.
+    """
+
+    def __init__(self, penalizer_coef=0.0):
+        self.penalizer_coef = penalizer_coef
+
+    @classmethod
+    def from_params(cls, params, penalizer_coef=0.0):
+        """A fitter holding already fitted (r, alpha, a, b), ready to predict."""
+        bgf = cls(penalizer_coef)
+        bgf.params_ = pd.Series(np.asarray(params, dtype="float64"), index=PARAM_NAMES)
+        return bgf
+
+    def fit(self, frequency, recency, T, weights=None, initial_params=None, tol=1e-10, maxiter=1000):
+        # scipy.optimize is only needed to fit; scoring-only processes never import it
+        from scipy.optimize import minimize
+
+        frequency = np.asarray(frequency).astype(int)
+        recency = np.asarray(recency, dtype="float64")
+        T = np.asarray(T, dtype="float64")
+        weights = np.ones_like(recency) if weights is None else np.asarray(weights, dtype="float64")
+
+        self._scale = 1.0 / T.max()
+        if initial_params is None:
+            # lifetimes' starting point: every log parameter at 0.1
+            x0 = 0.1 * np.ones(4)
+        else:
+            r, alpha, a, b = np.asarray(initial_params, dtype="float64")
+            x0 = np.log([r, alpha * self._scale, a, b])
+
+        output = minimize(negative_log_likelihood, x0,
+                          args=(frequency, recency * self._scale, T * self._scale, weights, self.penalizer_coef),
+                          jac=True, method="L-BFGS-B", bounds=LOG_PARAM_BOUNDS, tol=tol,
+                          options={"maxiter": maxiter})
+        if not output.success:
+            raise RuntimeError(f"BG/NBD fit did not converge: {output.message}")
+
+        params = np.exp(output.x)
+        params[1] /= self._scale
+        self.params_ = pd.Series(params, index=PARAM_NAMES)
+        self._negative_log_likelihood_ = output.fun
+        self.n_iter_ = output.nit
+        return self
+
+    def conditional_expected_number_of_purchases_up_to_time(self, t, frequency, recency, T):
+        values = conditional_expected_number_of_purchases_up_to_time(
+            self.params_[PARAM_NAMES].to_numpy(), t,
+            np.asarray(frequency), np.asarray(recency), np.asarray(T))
+        return _like(values, frequency)
+
+    predict = conditional_expected_number_of_purchases_up_to_time
+
+    def predict_horizons(self, horizons, frequency, recency, T):
+        """Expected purchases for every horizon at once (a DataFrame with one column
+        per horizon for Series input), instead of one predict call per horizon."""
+        values = expected_purchases_by_horizon(self.params_[PARAM_NAMES].to_numpy(), horizons,
+                                               frequency, recency, T)
+        if isinstance(frequency, pd.Series):
+            return pd.DataFrame(values, index=frequency.index, columns=list(horizons))
+        return values
@@ -0,0 +1,136 @@
+##############################################################
+# Bootstrap intervals for CLV and segment stability
+##############################################################
+
+# Each replicate resamples the customers with replacement, refits BG/NBD and
+# Gamma-Gamma and rescores every customer with the refitted models. Resampling
+# n customers is a multinomial count per customer, so a replicate is only a new
+# weight vector over the distinct profiles the full-data fit already uses
+# (rfm.unique_profiles); both fitters start from the full-data parameters.
+#
+# The profiles are written once into shared memory; workers attach to it and
+# write each replicate's CLV and segment codes into a shared
+# (n_replicates x n_customers) output block, so only seeds cross the process
+# boundary. The output holds 5 bytes per customer and replicate.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from bgnbd import BGNBDFitter
+from cltv import (BGNBD_PROFILE_COLUMNS, GAMMA_GAMMA_PROFILE_COLUMNS, SEGMENT_LABELS, fit_cltv_model, score_cltv,
+                  score_profiles, segment_edges, weekly_summary)
+from model_store import CLTVModel
+from parallel import attach_arrays, share_arrays
+from rfm import unique_profiles
+
+CLV_PROFILE_COLUMNS = ["frequency", "recency", "T", "monetary"]
+
+_shared = {}
+
+
+def _init_worker(spec, out_spec, model, month):
+    _shared["shm"], _shared["arrays"] = attach_arrays(spec)
+    _shared["out_shm"], _shared["out"] = attach_arrays(out_spec, writable=True)
+    _shared["model"] = model
+    _shared["month"] = month
+
+
+def segment_codes(clv, edges):
+    # position in SEGMENT_LABELS, the same bins as clv_segments(clv, edges)
+    return np.searchsorted(edges[1:-1], clv, side="left").astype("int8")
+
+
+def _replicate(replicate, seed):
+    """Fit and score one bootstrap replicate; returns (r, alpha, a, b, p, q, v) or None."""
+    from lifetimes import GammaGammaFitter
+
+    arrays, out, model = _shared["arrays"], _shared["out"], _shared["model"]
+    n_customers = len(arrays["bgnbd_inverse"])
+    rng = np.random.default_rng(seed)
+    counts = np.bincount(rng.integers(0, n_customers, n_customers), minlength=n_customers)
+
+    try:
+        weights = np.bincount(arrays["bgnbd_inverse"], weights=counts, minlength=len(arrays["bgnbd"]))
+        keep = weights > 0
+        profiles = arrays["bgnbd"][keep]
+        bgf = BGNBDFitter(penalizer_coef=model.bgnbd_penalizer)
+        bgf.fit(profiles[:, 0], profiles[:, 1], profiles[:, 2], weights=weights[keep],
+                initial_params=model.bgnbd_params)
+
+        weights = np.bincount(arrays["gg_inverse"], weights=counts, minlength=len(arrays["gg"]))
+        keep = weights > 0
+        profiles = arrays["gg"][keep]
+        ggf = GammaGammaFitter(penalizer_coef=model.gamma_gamma_penalizer)
+        # lifetimes takes the starting point as log parameters
+        ggf.fit(profiles[:, 0], profiles[:, 1], weights=weights[keep],
+                initial_params=np.log(model.gamma_gamma_params))
+    except (RuntimeError, ValueError, np.linalg.LinAlgError):
+        out["clv"][replicate] = np.nan
+        out["segment"][replicate] = -1
+        return None
+
+    replicate_model = CLTVModel(bgf.params_, ggf.params_[["p", "q", "v"]])
+    clv_profiles = arrays["clv"]
+    clv = score_profiles(replicate_model, *clv_profiles.T, month=_shared["month"])["clv"][arrays["clv_inverse"]]
+    out["clv"][replicate] = clv
+    out["segment"][replicate] = segment_codes(clv, segment_edges(clv))
+    return replicate_model.bgnbd_params + replicate_model.gamma_gamma_params
+
+
+def bootstrap_cltv(cltv_df, model=None, n_replicates=200, month=3, alpha=0.05, processes=None, seed=0):
+    """Percentile intervals of CLV and segment-flip probabilities per customer.
+
+    cltv_df: an rfm_summary table; model: its full-data CLTVModel (fitted here if None).
+    Returns (customers, params):
+      customers  create_cltv_p's columns plus clv_lower / clv_upper (the alpha/2 and
+                 1 - alpha/2 percentiles), segment_flip_probability (share of
+                 replicates whose quartile segment differs from `segment`) and
+                 p_D ... p_A, the share of replicates in each segment
+      params     fitted (r, alpha, a, b, p, q, v) of every replicate that converged
+    """
+    if model is None:
+        model = fit_cltv_model(cltv_df)
+    point = score_cltv(cltv_df, model, month)
+
+    weekly = weekly_summary(cltv_df)
+    bgnbd, _, bgnbd_inverse = unique_profiles(weekly, BGNBD_PROFILE_COLUMNS)
+    gg, _, gg_inverse = unique_profiles(weekly, GAMMA_GAMMA_PROFILE_COLUMNS)
+    clv, _, clv_inverse = unique_profiles(weekly, CLV_PROFILE_COLUMNS)
+    n_customers = len(weekly)
+
+    shm, spec = share_arrays({"bgnbd": bgnbd.to_numpy(), "bgnbd_inverse": bgnbd_inverse,
+                              "gg": gg.to_numpy(), "gg_inverse": gg_inverse,
+                              "clv": clv.to_numpy(), "clv_inverse": clv_inverse})
+    out_shm, out_spec = share_arrays({"clv": np.zeros((n_replicates, n_customers), dtype="float32"),
+                                      "segment": np.zeros((n_replicates, n_customers), dtype="int8")})
+    seeds = np.random.SeedSequence(seed).spawn(n_replicates)
+    try:
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(spec, out_spec, model, month)) as executor:
+            params = list(executor.map(_replicate, range(n_replicates), seeds,
+                                       chunksize=max(1, n_replicates // (4 * (processes or os.cpu_count())))))
+        view_shm, out = attach_arrays(out_spec)
+        converged = np.array([p is not None for p in params])
+        clv_draws = out["clv"][converged]
+        segment_draws = out["segment"][converged]
+
+        lower, upper = np.percentile(clv_draws, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+        segment_share = np.stack([(segment_draws == code).mean(axis=0) for code in range(len(SEGMENT_LABELS))])
+        point_codes = point["segment"].cat.codes.to_numpy()
+        del out, clv_draws, segment_draws
+        view_shm.close()
+    finally:
+        for block in (shm, out_shm):
+            block.close()
+            block.unlink()
+
+    point["clv_lower"] = lower
+    point["clv_upper"] = upper
+    point["segment_flip_probability"] = 1 - segment_share[point_codes, np.arange(n_customers)]
+    for code, label in enumerate(SEGMENT_LABELS):
+        point[f"p_{label}"] = segment_share[code]
+    params = pd.DataFrame([p for p in params if p is not None], columns=["r", "alpha", "a", "b", "p", "q", "v"])
+    return point, params
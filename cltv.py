@@ -0,0 +1,208 @@
+##############################################################
+# BG-NBD & GAMMA GAMMA models on the RFM summary
+##############################################################
+
+import numpy as np
+import pandas as pd
+
+from bgnbd import BGNBDFitter
+from clv import conditional_expected_average_profit, customer_lifetime_value, expected_and_discounted_purchases
+from instrumentation import NULL_PROFILER
+from model_store import CLTVModel, data_fingerprint
+from rfm import unique_profiles
+
+BGNBD_PROFILE_COLUMNS = ["frequency", "recency", "T"]
+GAMMA_GAMMA_PROFILE_COLUMNS = ["frequency", "monetary"]
+SEGMENT_LABELS = ["D", "C", "B", "A"]
+
+
+def weekly_summary(cltv_df):
+    # repeat customers only, monetary per purchase, recency and T in weeks
+    cltv_df = cltv_df[(cltv_df['frequency'] > 1)].copy()
+    cltv_df["monetary"] = cltv_df["monetary"] / cltv_df["frequency"]
+    cltv_df["recency"] = cltv_df["recency"] / 7
+    cltv_df["T"] = cltv_df["T"] / 7
+    return cltv_df
+
+
+def fit_cltv_profiles(profiles, weights, gg_profiles, gg_weights, thresholds=None, bgf_params=None,
+                      profiler=NULL_PROFILER):
+    """Fit BG/NBD on weighted (frequency, recency, T) profiles and Gamma-Gamma on
+    weighted (frequency, monetary) profiles, in weekly_summary units.
+
+    The profiles come from unique_profiles, or from rfm.merge_profiles when the
+    customers are summarized partition by partition.
+    """
+    # lifetimes is only needed to fit; scoring with a saved model never imports it
+    from lifetimes import GammaGammaFitter
+
+    with profiler.stage("fit_bgnbd") as info:
+        bgf = BGNBDFitter(penalizer_coef=0.001)
+        bgf.fit(profiles['frequency'],
+                profiles['recency'],
+                profiles['T'],
+                weights=weights,
+                initial_params=bgf_params)
+        info.update(rows_in=len(profiles), n_iter=bgf.n_iter_)
+
+    with profiler.stage("fit_gamma_gamma") as info:
+        ggf = GammaGammaFitter(penalizer_coef=0.01)
+        ggf.fit(gg_profiles['frequency'], gg_profiles['monetary'], weights=gg_weights)
+        info["rows_in"] = len(gg_profiles)
+
+    return CLTVModel(bgf.params_, ggf.params_[["p", "q", "v"]],
+                     bgnbd_penalizer=bgf.penalizer_coef,
+                     gamma_gamma_penalizer=ggf.penalizer_coef,
+                     thresholds=thresholds,
+                     n_customers=int(np.sum(weights)))
+
+
+def fit_cltv_model(cltv_df, thresholds=None, bgf_params=None, profiler=NULL_PROFILER):
+    """Fit BG/NBD and Gamma-Gamma on an rfm_summary table and return a CLTVModel.
+
+    bgf_params: (r, alpha, a, b) of a previous fit to warm-start BG/NBD from.
+    profiler: an instrumentation.Profiler to record the profiles / fit_bgnbd /
+    fit_gamma_gamma stages.
+    """
+    with profiler.stage("profiles") as info:
+        info["rows_in"] = len(cltv_df)
+        cltv_df = weekly_summary(cltv_df)
+
+        # Customers with the same (frequency, recency, T) share every BG/NBD term, so
+        # the models are fitted once per distinct profile, weighted by its customer count.
+        profiles, weights, _ = unique_profiles(cltv_df, BGNBD_PROFILE_COLUMNS)
+        gg_profiles, gg_weights, _ = unique_profiles(cltv_df, GAMMA_GAMMA_PROFILE_COLUMNS)
+        info["rows_out"] = len(cltv_df)
+
+    model = fit_cltv_profiles(profiles, weights, gg_profiles, gg_weights, thresholds, bgf_params, profiler)
+    model.fingerprint = data_fingerprint(cltv_df)
+    return model
+
+
+def segment_edges(clv):
+    """The quartile bin edges pd.qcut(clv, 4) would use."""
+    return np.quantile(np.asarray(clv, dtype="float64"), np.linspace(0, 1, len(SEGMENT_LABELS) + 1))
+
+
+def clv_segments(clv, edges=None):
+    # edges: segment_edges of a larger population (all partitions) or the edges of
+    # frozen segmentation.SegmentCuts, so that the segments of a part agree with a
+    # single qcut over the whole; values outside the edges go to the end segments
+    if edges is None:
+        return pd.qcut(clv, len(SEGMENT_LABELS), labels=SEGMENT_LABELS)
+    clv = np.asarray(clv, dtype="float64")
+    codes = np.searchsorted(np.asarray(edges, dtype="float64")[1:-1], clv, side="left")
+    return pd.Categorical.from_codes(np.where(np.isnan(clv), -1, codes), categories=SEGMENT_LABELS, ordered=True)
+
+
+def score_cltv(cltv_df, model, month=3, profiler=NULL_PROFILER, edges=None, cache=None):
+    """Expected purchases, expected profit, CLV and segment from fitted parameters.
+
+    edges: fixed segment bin edges (segment_edges); by default the quartiles of cltv_df.
+    cache: a prediction_cache.PredictionCache; the predict stage then scores through
+    it and only profiles it has not seen for this model and month are computed.
+    """
+    cltv_final = predict_cltv(cltv_df, model, month, profiler, cache)
+    with profiler.stage("segment") as info:
+        cltv_final["segment"] = clv_segments(cltv_final["clv"], edges)
+        info.update(rows_in=len(cltv_final), rows_out=len(cltv_final))
+    return cltv_final
+
+
+def predict_cltv(cltv_df, model, month=3, profiler=NULL_PROFILER, cache=None):
+    """score_cltv without the segment column, for callers that segment later
+    (e.g. with cut points over several blocks)."""
+    if cache is not None:
+        return _predict_cltv_cached(cltv_df, model, month, profiler, cache)
+    bgf, ggf = model.bgf, model.ggf
+
+    with profiler.stage("predict") as info:
+        info["rows_in"] = len(cltv_df)
+        cltv_df = weekly_summary(cltv_df)
+
+        # every term is evaluated once per distinct profile and scattered back with [inverse]
+        profiles, _, inverse = unique_profiles(cltv_df, BGNBD_PROFILE_COLUMNS)
+
+        # 1 week, 1 month and 3 months in one pass over the profiles
+        expected_purchases = bgf.predict_horizons([1, 4, 12],
+                                                  profiles['frequency'],
+                                                  profiles['recency'],
+                                                  profiles['T']).to_numpy()[inverse]
+        cltv_df["expected_purc_1_week"] = expected_purchases[:, 0]
+        cltv_df["expected_purc_1_month"] = expected_purchases[:, 1]
+        cltv_df["expected_purc_3_month"] = expected_purchases[:, 2]
+
+        gg_profiles, _, gg_inverse = unique_profiles(cltv_df, GAMMA_GAMMA_PROFILE_COLUMNS)
+        cltv_df["expected_average_profit"] = ggf.conditional_expected_average_profit(
+            gg_profiles['frequency'],
+            gg_profiles['monetary']).to_numpy()[gg_inverse]
+        info["rows_out"] = len(cltv_df)
+
+    with profiler.stage("clv") as info:
+        clv_profiles, _, clv_inverse = unique_profiles(cltv_df, ["frequency", "recency", "T", "monetary"])
+        cltv = customer_lifetime_value(bgf,
+                                       ggf,
+                                       clv_profiles['frequency'],
+                                       clv_profiles['recency'],
+                                       clv_profiles['T'],
+                                       clv_profiles['monetary'],
+                                       time=month,  # 3 aylık
+                                       freq="W",  # T'nin frekans bilgisi.
+                                       discount_rate=0.01)
+
+        cltv_df["clv"] = cltv.to_numpy()[clv_inverse]
+        info.update(rows_in=len(cltv_df), rows_out=len(clv_profiles))
+
+    return cltv_df.reset_index()
+
+
+def _predict_cltv_cached(cltv_df, model, month, profiler, cache):
+    with profiler.stage("predict") as info:
+        info["rows_in"] = len(cltv_df)
+        cltv_df = weekly_summary(cltv_df)
+        hits, misses = cache.hits + cache.disk_hits, cache.misses
+        scores = score_profiles(model, cltv_df["frequency"], cltv_df["recency"], cltv_df["T"], cltv_df["monetary"],
+                                month, cache=cache)
+        cltv_df["expected_purc_1_week"] = scores["expected_purchases"][:, 0]
+        cltv_df["expected_purc_1_month"] = scores["expected_purchases"][:, 1]
+        cltv_df["expected_purc_3_month"] = scores["expected_purchases"][:, 2]
+        cltv_df["expected_average_profit"] = scores["expected_average_profit"]
+        cltv_df["clv"] = scores["clv"]
+        info.update(rows_out=len(cltv_df), cache_hits=cache.hits + cache.disk_hits - hits,
+                    cache_misses=cache.misses - misses)
+
+    return cltv_df.reset_index()
+
+
+def cltv_from_summary(cltv_df, month=3, bgf_params=None, model=None, profiler=NULL_PROFILER, edges=None):
+    # model: a fitted CLTVModel to score with instead of refitting
+    if model is None:
+        model = fit_cltv_model(cltv_df, bgf_params=bgf_params, profiler=profiler)
+    return score_cltv(cltv_df, model, month, profiler, edges)
+
+
+def score_profiles(model, frequency, recency, T, monetary, month=3, horizons=(1, 4, 12), discount_rate=0.01,
+                   cache=None, dtype="float64"):
+    """score_cltv on plain arrays (weekly units, monetary per purchase), without
+    deduplication or segmenting; used for per-request scoring, so it stays on raw
+    NumPy parameters and skips the pandas wrappers.
+
+    cache: a prediction_cache.PredictionCache to serve repeated profiles from.
+    dtype: "float32" halves the memory traffic and evaluates the BG/NBD terms with
+    bgnbd.conditional_expected_number_of_purchases_float32 (see benchmark.py --scoring
+    for its error against float64).
+    """
+    if cache is not None:
+        return cache.score_profiles(model, frequency, recency, T, monetary, month, horizons, discount_rate, dtype)
+    bgnbd_params = np.asarray(model.bgnbd_params)
+    frequency, recency, T, monetary = (np.asarray(v, dtype=dtype) for v in (frequency, recency, T, monetary))
+    # Python floats keep float32 arrays in float32
+    expected_average_profit = conditional_expected_average_profit(list(model.gamma_gamma_params),
+                                                                  frequency, monetary)
+    # the horizons and the CLV month ends in one evaluation of the BG/NBD terms
+    expected_purchases, discounted = expected_and_discounted_purchases(bgnbd_params, horizons, frequency, recency,
+                                                                       T, time=month, discount_rate=discount_rate,
+                                                                       freq="W", dtype=dtype)
+    return {"expected_purchases": expected_purchases,
+            "expected_average_profit": expected_average_profit,
+            "clv": expected_average_profit * discounted}
@@ -0,0 +1,83 @@
+##############################################################
+# Discounted CLV over all months at once
+##############################################################
+
+# lifetimes' customer_lifetime_value loops over the months and calls predict twice
+# per month to difference the cumulative expected purchases. Here the cumulative
+# purchases for every month end come from one customers x months matrix, and
+# differencing, discounting and the sum over months are array operations.
+
+import numpy as np
+import pandas as pd
+
+from bgnbd import PARAM_NAMES, expected_purchases_by_horizon
+
+# periods of T's unit per month, as in lifetimes
+FREQ_FACTOR = {"W": 4.345, "M": 1.0, "D": 30, "H": 30 * 24}
+GAMMA_GAMMA_PARAM_NAMES = ["p", "q", "v"]
+
+
+def conditional_expected_average_profit(gamma_gamma_params, frequency, monetary_value):
+    """Gamma-Gamma expected average profit, as in lifetimes.GammaGammaFitter."""
+    p, q, v = gamma_gamma_params
+    individual_weight = p * frequency / (p * frequency + q - 1)
+    population_mean = v * p / (q - 1)
+    return (1 - individual_weight) * population_mean + individual_weight * monetary_value
+
+
+class GammaGammaModel:
+    """Scoring-only Gamma-Gamma model from fitted (p, q, v); no lifetimes import."""
+
+    def __init__(self, params):
+        self.params_ = pd.Series(np.asarray(params, dtype="float64"), index=GAMMA_GAMMA_PARAM_NAMES)
+
+    def conditional_expected_average_profit(self, frequency, monetary_value):
+        values = conditional_expected_average_profit(self.params_[GAMMA_GAMMA_PARAM_NAMES].to_numpy(),
+                                                     np.asarray(frequency, dtype="float64"),
+                                                     np.asarray(monetary_value, dtype="float64"))
+        if isinstance(frequency, pd.Series):
+            return pd.Series(values, index=frequency.index)
+        return values
+
+
+def expected_and_discounted_purchases(bgnbd_params, horizons, frequency, recency, T, time=12, discount_rate=0.01,
+                                      freq="D", batch_size=200_000, dtype="float64"):
+    """expected_purchases_by_horizon(horizons) and discounted_expected_purchases(time)
+    from one evaluation of the horizons and the month ends together."""
+    factor = FREQ_FACTOR[freq]
+    months = np.arange(1, time + 1)
+    discount = (1 / (1 + discount_rate) ** months).astype(dtype)
+    points = np.r_[np.asarray(horizons, dtype="float64"), months * factor]
+    n_horizons = len(points) - time
+    frequency, recency, T = (np.asarray(v, dtype=dtype) for v in (frequency, recency, T))
+
+    expected = np.empty((len(frequency), n_horizons), dtype=dtype)
+    discounted = np.empty(len(frequency), dtype=dtype)
+    # customers are processed in blocks so that long horizons stay within memory
+    for start in range(0, len(frequency), batch_size):
+        block = slice(start, start + batch_size)
+        cumulative = expected_purchases_by_horizon(bgnbd_params, points,
+                                                   frequency[block], recency[block], T[block], dtype)
+        expected[block] = cumulative[:, :n_horizons]
+        per_month = np.diff(cumulative[:, n_horizons:], axis=1, prepend=0.0)
+        discounted[block] = per_month @ discount
+    return expected, discounted
+
+
+def discounted_expected_purchases(bgnbd_params, frequency, recency, T, time=12, discount_rate=0.01, freq="D",
+                                  batch_size=200_000, dtype="float64"):
+    """Sum over months of E[purchases in month m] / (1 + discount_rate) ** m."""
+    return expected_and_discounted_purchases(bgnbd_params, [], frequency, recency, T, time, discount_rate, freq,
+                                             batch_size, dtype)[1]
+
+
+def customer_lifetime_value(bgf, ggf, frequency, recency, T, monetary_value, time=12, discount_rate=0.01, freq="D"):
+    """Same result as ggf.customer_lifetime_value(bgf, ...) without the monthly loop."""
+    adjusted_monetary_value = np.asarray(ggf.conditional_expected_average_profit(frequency, monetary_value),
+                                         dtype="float64")
+    clv = adjusted_monetary_value * discounted_expected_purchases(bgf.params_[PARAM_NAMES].to_numpy(),
+                                                                  frequency, recency, T,
+                                                                  time, discount_rate, freq)
+    if isinstance(frequency, pd.Series):
+        return pd.Series(clv, index=frequency.index, name="clv")
+    return clv
@@ -0,0 +1,185 @@
+##############################################################
+# Calibration / holdout evaluation
+##############################################################
+
+# Headless replacement for eyeballing plot_period_transactions: the cleaned
+# transactions are split at a calibration date, the models are fitted on the
+# calibration summary and the purchases and revenue they predict for the
+# holdout window are compared with what the customers actually did.
+#
+# Customers and invoices are encoded once; the calibration summary and the
+# holdout counts are segment reductions over the same arrays. Several cutoffs
+# share those arrays through shared memory and are evaluated on a process pool.
+#
+#   customers, metrics = evaluate_holdout(cleaned, "2011-06-01", "2011-12-09")
+#   drift = sweep_cutoffs(cleaned, ["2011-03-01", "2011-06-01", "2011-09-01"], holdout_days=90)
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cltv import fit_cltv_model, weekly_summary
+from parallel import attach_arrays, share_arrays
+from rfm import NS_PER_DAY, _encode, _segment_stats, summary_frame, to_epoch_ns
+
+N_DECILES = 10
+
+
+def _to_ns(date):
+    return int(to_epoch_ns(np.datetime64(pd.Timestamp(date), "ns")))
+
+
+def _calibration_holdout(customers, cust_codes, inv_codes, n_invoices, dates, total_price, cutoff_ns, end_ns):
+    """Calibration RFM summary of the customers seen up to cutoff_ns, with their
+    distinct invoices and revenue in (cutoff_ns, end_ns]."""
+    if end_ns <= cutoff_ns:
+        raise ValueError(f"holdout window ends at {pd.Timestamp(end_ns)}, before the cutoff {pd.Timestamp(cutoff_ns)}")
+    calibration = dates <= cutoff_ns
+    present = np.unique(cust_codes[calibration])
+    codes = np.searchsorted(present, cust_codes[calibration])
+    first, last, frequency, monetary, _, _ = _segment_stats(codes, len(present), inv_codes[calibration],
+                                                            n_invoices, dates[calibration], total_price[calibration])
+    cutoff = pd.Timestamp(cutoff_ns)
+    summary = summary_frame(customers[present], first, last, frequency, monetary, cutoff)
+
+    holdout = (dates > cutoff_ns) & (dates <= end_ns)
+    positions = np.searchsorted(present, cust_codes[holdout])
+    known = positions < len(present)
+    known[known] = present[positions[known]] == cust_codes[holdout][known]
+    positions, holdout_invoices = positions[known], inv_codes[holdout][known]
+    pair_keys = np.unique(positions.astype("int64") * max(n_invoices, 1) + holdout_invoices)
+    summary["frequency_holdout"] = np.bincount(pair_keys // max(n_invoices, 1), minlength=len(present))
+    summary["monetary_holdout"] = np.bincount(positions, weights=total_price[holdout][known], minlength=len(present))
+    summary["duration_holdout"] = (end_ns - cutoff_ns) // NS_PER_DAY
+    return summary
+
+
+def calibration_holdout_summary(dataframe, calibration_end, observation_end=None, customer_col="Customer ID"):
+    """recency / T / frequency / monetary up to calibration_end (T measured at
+    calibration_end), plus frequency_holdout, monetary_holdout and duration_holdout
+    (days) for the window after it. dataframe: cleaned transactions with TotalPrice."""
+    cust_codes, customers, inv_codes, invoices, dates, total_price = _encode(dataframe, customer_col, sort=True)
+    end_ns = dates.max() if observation_end is None else _to_ns(observation_end)
+    return _calibration_holdout(customers, cust_codes, inv_codes, len(invoices), dates, total_price,
+                                _to_ns(calibration_end), end_ns)
+
+
+def holdout_metrics(predicted, actual):
+    """MAE, RMSE, bias and decile lift of one predicted/actual pair of arrays.
+
+    Customers are ranked by prediction into deciles (decile 1 = highest); lift is
+    the decile's mean actual value over the mean actual value of all customers.
+    """
+    predicted = np.asarray(predicted, dtype="float64")
+    actual = np.asarray(actual, dtype="float64")
+    error = predicted - actual
+    ranks = np.empty(len(predicted), dtype="int64")
+    ranks[np.argsort(-predicted, kind="stable")] = np.arange(len(predicted))
+    deciles = ranks * N_DECILES // max(len(predicted), 1)
+    counts = np.bincount(deciles, minlength=N_DECILES)
+    decile_actual = np.bincount(deciles, weights=actual, minlength=N_DECILES) / np.maximum(counts, 1)
+    decile_predicted = np.bincount(deciles, weights=predicted, minlength=N_DECILES) / np.maximum(counts, 1)
+    mean_actual = actual.mean() if len(actual) else np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lift = decile_actual / mean_actual
+    return {"mae": float(np.abs(error).mean()),
+            "rmse": float(np.sqrt((error ** 2).mean())),
+            "bias": float(error.mean()),
+            "total_predicted": float(predicted.sum()),
+            "total_actual": float(actual.sum()),
+            "decile_predicted": decile_predicted.tolist(),
+            "decile_actual": decile_actual.tolist(),
+            "decile_lift": lift.tolist(),
+            "top_decile_lift": float(lift[0])}
+
+
+def _evaluate(summary, bgf_params=None):
+    # the population create_cltv_p scores: repeat customers, weekly units
+    model = fit_cltv_model(summary[["recency", "T", "frequency", "monetary"]], bgf_params=bgf_params)
+    weekly = weekly_summary(summary)
+    horizon = weekly["duration_holdout"].to_numpy() / 7
+    predicted_purchases = model.bgf.conditional_expected_number_of_purchases_up_to_time(
+        horizon, weekly["frequency"].to_numpy(), weekly["recency"].to_numpy(), weekly["T"].to_numpy())
+    expected_average_profit = model.ggf.conditional_expected_average_profit(weekly["frequency"].to_numpy(),
+                                                                            weekly["monetary"].to_numpy())
+    customers = pd.DataFrame({"predicted_purchases": predicted_purchases,
+                              "actual_purchases": weekly["frequency_holdout"].to_numpy(),
+                              "predicted_revenue": predicted_purchases * expected_average_profit,
+                              "actual_revenue": weekly["monetary_holdout"].to_numpy()},
+                             index=weekly.index)
+    metrics = {"customers": len(customers),
+               "purchases": holdout_metrics(customers["predicted_purchases"], customers["actual_purchases"]),
+               "revenue": holdout_metrics(customers["predicted_revenue"], customers["actual_revenue"]),
+               "bgnbd_params": model.bgnbd_params,
+               "gamma_gamma_params": model.gamma_gamma_params}
+    return customers, metrics
+
+
+def evaluate_holdout(dataframe, calibration_end, observation_end=None, customer_col="Customer ID"):
+    """Fit on the transactions up to calibration_end and score the holdout window.
+
+    Returns (customers, metrics): predicted vs actual purchases and revenue per
+    repeat customer, and holdout_metrics of both plus the calibration parameters.
+    """
+    summary = calibration_holdout_summary(dataframe, calibration_end, observation_end, customer_col)
+    return _evaluate(summary)
+
+
+##############################################################
+# Cutoff sweep
+##############################################################
+
+_shared = {}
+
+
+def _init_worker(spec, customers):
+    _shared["shm"], _shared["arrays"] = attach_arrays(spec)
+    _shared["customers"] = customers
+
+
+def _evaluate_cutoff(cutoff_ns, end_ns, n_invoices):
+    arrays = _shared["arrays"]
+    summary = _calibration_holdout(_shared["customers"], arrays["cust_codes"], arrays["inv_codes"], n_invoices,
+                                   arrays["dates"], arrays["total_price"], cutoff_ns, end_ns)
+    return _evaluate(summary)[1]
+
+
+def sweep_cutoffs(dataframe, cutoffs, holdout_days=None, observation_end=None, processes=None,
+                  customer_col="Customer ID"):
+    """evaluate_holdout at every cutoff, in parallel; one row of metrics per cutoff.
+
+    holdout_days: length of every holdout window, so that cutoffs are comparable;
+    by default each window runs to observation_end (or the last transaction).
+    The workers are processes: call it under `if __name__ == "__main__":`, or
+    spawned workers re-run the calling script.
+    """
+    cust_codes, customers, inv_codes, invoices, dates, total_price = _encode(dataframe, customer_col, sort=True)
+    end_ns = dates.max() if observation_end is None else _to_ns(observation_end)
+    cutoff_ns = [_to_ns(cutoff) for cutoff in cutoffs]
+    end_ns = [min(cutoff + holdout_days * NS_PER_DAY, end_ns) if holdout_days else end_ns for cutoff in cutoff_ns]
+    for cutoff, end in zip(cutoff_ns, end_ns):
+        if end <= cutoff:
+            raise ValueError(f"cutoff {pd.Timestamp(cutoff)} leaves no holdout window (data ends {pd.Timestamp(end)})")
+
+    shm, spec = share_arrays({"cust_codes": cust_codes, "inv_codes": inv_codes,
+                              "dates": dates, "total_price": total_price})
+    try:
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(spec, customers)) as executor:
+            results = list(executor.map(_evaluate_cutoff, cutoff_ns, end_ns, [len(invoices)] * len(cutoff_ns)))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    rows = []
+    for cutoff, end, metrics in zip(cutoffs, end_ns, results):
+        row = {"cutoff": pd.Timestamp(cutoff), "holdout_end": pd.Timestamp(end), "customers": metrics["customers"]}
+        for target in ("purchases", "revenue"):
+            for name in ("mae", "rmse", "bias", "total_predicted", "total_actual", "top_decile_lift"):
+                row[f"{target}_{name}"] = metrics[target][name]
+        row.update(zip(["r", "alpha", "a", "b"], metrics["bgnbd_params"]))
+        row.update(zip(["p", "q", "v"], metrics["gamma_gamma_params"]))
+        rows.append(row)
+    return pd.DataFrame(rows)
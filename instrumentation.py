@@ -0,0 +1,186 @@
+##############################################################
+# Per-stage instrumentation of the pipeline
+##############################################################
+
+# create_cltv_p, fit_cltv_model and score_cltv wrap their stages in
+# `with profiler.stage(name) as info:`. With the default NULL_PROFILER that is
+# a shared no-op context manager, so an uninstrumented run pays one method call
+# per stage. Passing a Profiler records for every stage
+#   wall_s, cpu_s          perf_counter / process_time
+#   rss_delta_mb           change of the resident set size over the stage
+#   peak_rss_delta_mb      growth of the process' peak RSS during the stage
+#   rows_in, rows_out, n_iter, ...   whatever the stage puts into `info`
+# and the records can be appended to a JSON lines file or written as a
+# Prometheus textfile-collector file.
+#
+#   profiler = Profiler()
+#   create_cltv_p(df, profiler=profiler)
+#   print(profiler.format())
+#   profiler.to_jsonl("runs.jsonl"); profiler.to_prometheus("cltv.prom")
+
+import datetime as dt
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROMETHEUS_METRICS = {"wall_s": ("cltv_stage_wall_seconds", "Wall time of a CLTV pipeline stage."),
+                      "cpu_s": ("cltv_stage_cpu_seconds", "CPU time of a CLTV pipeline stage."),
+                      "rss_delta_mb": ("cltv_stage_rss_delta_megabytes", "Change of resident memory over a stage."),
+                      "peak_rss_delta_mb": ("cltv_stage_peak_rss_delta_megabytes",
+                                            "Growth of the peak resident memory during a stage."),
+                      "peak_alloc_mb": ("cltv_stage_peak_alloc_megabytes",
+                                        "Peak traced Python/NumPy allocations of a stage."),
+                      "rows_in": ("cltv_stage_rows_in", "Rows entering a stage."),
+                      "rows_out": ("cltv_stage_rows_out", "Rows leaving a stage."),
+                      "n_iter": ("cltv_stage_optimizer_iterations", "Optimizer iterations of a fitting stage.")}
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    if resource is None:
+        return 0.0
+    # KiB on Linux, bytes on macOS
+    scale = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+class _NullStage:
+    def __enter__(self):
+        # a fresh dict per stage, so nothing written by one run is seen by another
+        return {}
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullProfiler:
+    """Default profiler: stage() hands back one shared no-op context manager."""
+
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler, self.name = profiler, name
+        self.info = {}
+
+    def __enter__(self):
+        if self.profiler.trace_memory:
+            tracemalloc.start()
+        self.rss, self.peak_rss = rss_mb(), peak_rss_mb()
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self.info
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        record = {"stage": self.name, "wall_s": wall, "cpu_s": cpu,
+                  "rss_delta_mb": rss_mb() - self.rss,
+                  "peak_rss_delta_mb": peak_rss_mb() - self.peak_rss}
+        if self.profiler.trace_memory:
+            record["peak_alloc_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        record.update(self.info)
+        self.profiler.records.append(record)
+        return False
+
+
+class Profiler:
+    """Records one dict per stage in `records`, in execution order.
+
+    labels: extra key/values (dataset, sheet, country, ...) written with every
+    record and as Prometheus labels. trace_memory also records the peak of
+    tracemalloc-traced allocations, at a noticeable cost in speed.
+    """
+
+    enabled = True
+
+    def __init__(self, labels=None, trace_memory=False):
+        self.labels = dict(labels or {})
+        self.trace_memory = trace_memory
+        self.run_id = uuid.uuid4().hex
+        self.started = dt.datetime.now().isoformat(timespec="seconds")
+        self.records = []
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def __getitem__(self, name):
+        # last record of the stage
+        for record in reversed(self.records):
+            if record["stage"] == name:
+                return record
+        raise KeyError(name)
+
+    @property
+    def total_wall_s(self):
+        return sum(record["wall_s"] for record in self.records)
+
+    def to_dict(self):
+        return {"run_id": self.run_id, "started": self.started, "labels": self.labels,
+                "total_wall_s": self.total_wall_s, "stages": self.records}
+
+    def format(self):
+        lines = [f"{'stage':<16}{'wall s':>10}{'cpu s':>10}{'rss +MB':>10}{'rows in':>10}{'rows out':>10}"]
+        for record in self.records:
+            lines.append(f"{record['stage']:<16}{record['wall_s']:>10.4f}{record['cpu_s']:>10.4f}"
+                         f"{record['rss_delta_mb']:>10.1f}{record.get('rows_in', ''):>10}"
+                         f"{record.get('rows_out', ''):>10}")
+        return "\n".join(lines)
+
+    def to_jsonl(self, path):
+        """Append one JSON line per stage to path."""
+        with open(path, "a") as f:
+            for record in self.records:
+                f.write(json.dumps({"run_id": self.run_id, "started": self.started, **self.labels, **record}) + "\n")
+        return path
+
+    def to_prometheus(self, path):
+        """Write the last run as a Prometheus text file (node_exporter textfile collector).
+
+        The file is replaced atomically so the collector never reads half of it.
+        """
+        lines = []
+        for key, (metric, help_text) in PROMETHEUS_METRICS.items():
+            samples = [(record["stage"], record[key]) for record in self.records if key in record]
+            if not samples:
+                continue
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+            for stage, value in samples:
+                labels = ",".join(f'{name}="{_escape(value)}"'
+                                  for name, value in {**self.labels, "stage": stage}.items())
+                lines.append(f"{metric}{{{labels}}} {float(value)!r}")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+        return path
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,93 @@
+##############################################################
+# Fitted model artifacts
+##############################################################
+
+# A fitted BG/NBD + Gamma-Gamma pair is a handful of numbers. Saving them with the
+# penalizers, the outlier thresholds used for cleaning and a fingerprint of the
+# training summary lets scoring-only runs skip the fitters: loading is a small
+# JSON read and imports neither lifetimes, matplotlib nor sklearn.
+
+import datetime as dt
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from bgnbd import PARAM_NAMES, BGNBDFitter
+from clv import GAMMA_GAMMA_PARAM_NAMES, GammaGammaModel
+
+FORMAT_VERSION = 1
+FINGERPRINT_COLUMNS = ["frequency", "recency", "T", "monetary"]
+
+
+def data_fingerprint(cltv_df):
+    """SHA-256 of the (weekly) training summary the models were fitted on."""
+    sha = hashlib.sha256()
+    sha.update(str(len(cltv_df)).encode())
+    for col in FINGERPRINT_COLUMNS:
+        sha.update(np.ascontiguousarray(cltv_df[col].to_numpy(dtype="float64")).tobytes())
+    return sha.hexdigest()
+
+
+class CLTVModel:
+    def __init__(self, bgnbd_params, gamma_gamma_params, bgnbd_penalizer=0.001, gamma_gamma_penalizer=0.01,
+                 thresholds=None, fingerprint=None, n_customers=None, fitted_at=None):
+        self.bgnbd_params = [float(v) for v in bgnbd_params]
+        self.gamma_gamma_params = [float(v) for v in gamma_gamma_params]
+        self.bgnbd_penalizer = bgnbd_penalizer
+        self.gamma_gamma_penalizer = gamma_gamma_penalizer
+        self.thresholds = thresholds
+        self.fingerprint = fingerprint
+        self.n_customers = n_customers
+        self.fitted_at = fitted_at or dt.datetime.now().isoformat(timespec="seconds")
+
+    def __repr__(self):
+        return (f"CLTVModel(fitted_at={self.fitted_at!r}, n_customers={self.n_customers}, "
+                f"fingerprint={self.fingerprint!r})")
+
+    @property
+    def bgf(self):
+        return BGNBDFitter.from_params(self.bgnbd_params, self.bgnbd_penalizer)
+
+    @property
+    def ggf(self):
+        return GammaGammaModel(self.gamma_gamma_params)
+
+    def to_dict(self):
+        return {"format_version": FORMAT_VERSION,
+                "bgnbd": {"params": dict(zip(PARAM_NAMES, self.bgnbd_params)),
+                          "penalizer_coef": self.bgnbd_penalizer},
+                "gamma_gamma": {"params": dict(zip(GAMMA_GAMMA_PARAM_NAMES, self.gamma_gamma_params)),
+                                "penalizer_coef": self.gamma_gamma_penalizer},
+                "thresholds": {variable: [float(low), float(up)]
+                               for variable, (low, up) in (self.thresholds or {}).items()},
+                "fingerprint": self.fingerprint,
+                "n_customers": self.n_customers,
+                "fitted_at": self.fitted_at}
+
+    @classmethod
+    def from_dict(cls, artifact):
+        if artifact.get("format_version", 0) > FORMAT_VERSION:
+            raise ValueError(f"model artifact version {artifact['format_version']} is newer than "
+                             f"supported version {FORMAT_VERSION}")
+        return cls([artifact["bgnbd"]["params"][name] for name in PARAM_NAMES],
+                   [artifact["gamma_gamma"]["params"][name] for name in GAMMA_GAMMA_PARAM_NAMES],
+                   artifact["bgnbd"]["penalizer_coef"],
+                   artifact["gamma_gamma"]["penalizer_coef"],
+                   {variable: tuple(limits) for variable, limits in artifact["thresholds"].items()} or None,
+                   artifact["fingerprint"],
+                   artifact["n_customers"],
+                   artifact["fitted_at"])
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+
+def load_model(path):
+    with open(path) as f:
+        return CLTVModel.from_dict(json.load(f))
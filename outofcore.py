@@ -0,0 +1,180 @@
+##############################################################
+# Out-of-core CLTV over hash-partitioned transaction files
+##############################################################
+
+# The history is split into directories by a hash of Customer ID, so all lines of
+# a customer are in exactly one partition and each partition's RFM summary is
+# final on its own. A local process pool then makes four passes over the
+# partitions, every worker holding one partition at a time:
+#
+#   1. value counts (exact) or KLL sketches of Quantity and Price -> the global
+#      outlier thresholds, as create_cltv_p computes them over the whole frame
+#   2. clean + rfm_summary; the summary is written to disk and the weighted
+#      distinct profiles are returned -> one BG/NBD + Gamma-Gamma fit in the parent
+#   3. a segmentation.CLVSegmenter of every partition's CLV -> merged into the
+#      quartile edges of the whole population (skipped with frozen cut points)
+#   4. score_cltv with those edges, written to disk partition by partition
+#
+# Only value counts, profiles and the CLV value counts (or sketches) reach the
+# parent process.
+#
+#   partition_transactions(iter_transactions("history.parquet"), "history_parts", n_partitions=64)
+#   model = create_cltv_p_out_of_core("history_parts", "cltv_out")
+#   cltv_final = read_scores("cltv_out")
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cltv import (BGNBD_PROFILE_COLUMNS, GAMMA_GAMMA_PROFILE_COLUMNS, fit_cltv_profiles, score_cltv,
+                  score_profiles, weekly_summary)
+from ingest import PIPELINE_COLUMNS, compact_transactions
+from preprocessing import (clean_chunk, merge_value_counts, thresholds_from_counts, thresholds_from_sketches,
+                           threshold_sketches, valid_value_counts)
+from rfm import TODAY_DATE, merge_profiles, rfm_summary, unique_profiles
+from segmentation import CLVSegmenter, SegmentCuts
+
+PARTITION_GLOB = "part-*"
+
+
+##############################################################
+# Partitioning
+##############################################################
+
+def customer_partition(customer_ids, n_partitions):
+    """Partition number of every (non-missing) customer id: a multiplicative hash,
+    so that consecutive ids spread over all partitions."""
+    keys = np.asarray(customer_ids, dtype="float64").astype("int64").view("uint64")
+    return ((keys * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)) % np.uint64(n_partitions)
+
+
+def partition_transactions(chunks, out_dir, n_partitions=16, customer_col="Customer ID"):
+    """Write raw transaction chunks to out_dir/part-NNNNN/chunk-MMMMMM.parquet by
+    hash of customer_col. Lines without a customer are dropped: cleaning would
+    drop them anyway and they take no part in the outlier thresholds."""
+    for i, chunk in enumerate(chunks):
+        known = chunk[customer_col].notna().to_numpy()
+        chunk = chunk[known]
+        partitions = customer_partition(chunk[customer_col].to_numpy(dtype="float64"), n_partitions)
+        order = np.argsort(partitions, kind="stable")
+        bounds = np.searchsorted(partitions[order], np.arange(n_partitions + 1))
+        for partition in range(n_partitions):
+            if bounds[partition] == bounds[partition + 1]:
+                continue
+            part_dir = os.path.join(out_dir, f"part-{partition:05d}")
+            os.makedirs(part_dir, exist_ok=True)
+            chunk.iloc[order[bounds[partition]:bounds[partition + 1]]].to_parquet(
+                os.path.join(part_dir, f"chunk-{i:06d}.parquet"), index=False)
+    return sorted(glob.glob(os.path.join(out_dir, PARTITION_GLOB)))
+
+
+def read_partition(part_dir, compact=False):
+    dataframe = pd.read_parquet(part_dir, columns=PIPELINE_COLUMNS)
+    return compact_transactions(dataframe) if compact else dataframe
+
+
+##############################################################
+# Workers
+##############################################################
+
+def _partition_thresholds(part_dir, method, compact):
+    dataframe = read_partition(part_dir, compact)
+    if method == "exact":
+        return valid_value_counts(dataframe)
+    return threshold_sketches([dataframe])
+
+
+def _summarize_partition(part_dir, summary_path, thresholds, compact, today_date):
+    cltv_df = rfm_summary(clean_chunk(read_partition(part_dir, compact), thresholds), today_date)
+    cltv_df.to_parquet(summary_path)
+    weekly = weekly_summary(cltv_df)
+    return (unique_profiles(weekly, BGNBD_PROFILE_COLUMNS)[:2],
+            unique_profiles(weekly, GAMMA_GAMMA_PROFILE_COLUMNS)[:2])
+
+
+def _partition_segmenter(summary_path, model, month, method):
+    weekly = weekly_summary(pd.read_parquet(summary_path))
+    clv = score_profiles(model, weekly["frequency"], weekly["recency"], weekly["T"], weekly["monetary"],
+                         month)["clv"]
+    return CLVSegmenter(method=method).update(clv)
+
+
+def _score_partition(summary_path, output_path, model, month, edges):
+    cltv_final = score_cltv(pd.read_parquet(summary_path), model, month, edges=edges)
+    cltv_final.to_parquet(output_path, index=False)
+    return len(cltv_final)
+
+
+##############################################################
+# Pipeline
+##############################################################
+
+def create_cltv_p_out_of_core(partition_dir, output_dir, month=3, thresholds="exact", processes=None,
+                              compact=False, model_path=None, segments="exact", today_date=TODAY_DATE):
+    """create_cltv_p over a directory written by partition_transactions.
+
+    thresholds: "exact" (merged value counts; matches create_cltv_p), "sketch"
+    (merged KLL sketches) or a dict of limits used as is.
+    compact: read every partition with compact dtypes (ingest.compact_transactions).
+    segments: "exact" (the quartiles pd.qcut gives over all customers), "sketch"
+    (merged KLL sketches) or frozen SegmentCuts of an earlier run.
+    today_date: the date recency and T are counted to.
+    Writes output_dir/summary/part-*.parquet (per-customer RFM) and
+    output_dir/scores/part-*.parquet (create_cltv_p's columns) and the cut points to
+    output_dir/segments.json; returns the fitted CLTVModel, also saved to model_path
+    (default output_dir/model.json).
+    """
+    part_dirs = sorted(glob.glob(os.path.join(partition_dir, PARTITION_GLOB)))
+    if not part_dirs:
+        raise ValueError(f"no {PARTITION_GLOB} directories in {partition_dir}")
+    names = [os.path.basename(part_dir) for part_dir in part_dirs]
+    summary_paths = [os.path.join(output_dir, "summary", name + ".parquet") for name in names]
+    score_paths = [os.path.join(output_dir, "scores", name + ".parquet") for name in names]
+    for path in (summary_paths[0], score_paths[0]):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as executor:
+        if isinstance(thresholds, str):
+            if thresholds not in ("exact", "sketch"):
+                raise ValueError(f"unknown threshold method: {thresholds}")
+            parts = list(executor.map(_partition_thresholds, part_dirs,
+                                      [thresholds] * len(part_dirs), [compact] * len(part_dirs)))
+            if thresholds == "exact":
+                thresholds = thresholds_from_counts(merge_value_counts(parts))
+            else:
+                sketches = parts[0]
+                for part in parts[1:]:
+                    for variable, sketch in part.items():
+                        sketches[variable].merge(sketch)
+                thresholds = thresholds_from_sketches(sketches)
+
+        profiles = list(executor.map(_summarize_partition, part_dirs, summary_paths,
+                                     [thresholds] * len(part_dirs), [compact] * len(part_dirs),
+                                     [today_date] * len(part_dirs)))
+        bgnbd_profiles, bgnbd_weights = merge_profiles([part[0] for part in profiles])
+        gg_profiles, gg_weights = merge_profiles([part[1] for part in profiles])
+        model = fit_cltv_profiles(bgnbd_profiles, bgnbd_weights, gg_profiles, gg_weights, thresholds)
+
+        if isinstance(segments, SegmentCuts):
+            cuts = segments
+        else:
+            segmenters = list(executor.map(_partition_segmenter, summary_paths, [model] * len(part_dirs),
+                                           [month] * len(part_dirs), [segments] * len(part_dirs)))
+            for segmenter in segmenters[1:]:
+                segmenters[0].merge(segmenter)
+            cuts = segmenters[0].freeze()
+        list(executor.map(_score_partition, summary_paths, score_paths, [model] * len(part_dirs),
+                          [month] * len(part_dirs), [cuts.edges] * len(part_dirs)))
+
+    cuts.save(os.path.join(output_dir, "segments.json"))
+    model.save(model_path or os.path.join(output_dir, "model.json"))
+    return model
+
+
+def read_scores(output_dir):
+    """All scored partitions in one frame, ordered by Customer ID like create_cltv_p."""
+    parts = [pd.read_parquet(path) for path in sorted(glob.glob(os.path.join(output_dir, "scores", "*.parquet")))]
+    return pd.concat(parts, ignore_index=True).sort_values("Customer ID", ignore_index=True)
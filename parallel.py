@@ -0,0 +1,134 @@
+##############################################################
+# Per-partition model fitting on a process pool
+##############################################################
+
+# Fits separate BG/NBD and Gamma-Gamma models per partition (Country, sheet,
+# year, ...) of the cleaned transactions. The per-customer summary of every
+# partition is written once into a shared memory block; worker processes attach
+# to it and read their partition's rows, so nothing but (start, end) offsets and
+# the result tables cross the process boundary.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from cltv import cltv_from_summary
+from preprocessing import clean_chunk, valid_rows, valid_thresholds
+from rfm import TODAY_DATE, rfm_summary
+
+SUMMARY_COLUMNS = ["Customer ID", "recency", "T", "frequency", "monetary"]
+
+
+##############################################################
+# Shared memory
+##############################################################
+
+def share_arrays(arrays):
+    """Copy arrays into one SharedMemory block.
+
+    Returns (shm, spec); spec is small and picklable and attach_arrays(spec)
+    rebuilds read-only views in another process. The caller closes and unlinks shm.
+    """
+    arrays = {name: np.ascontiguousarray(values) for name, values in arrays.items()}
+    shm = shared_memory.SharedMemory(create=True, size=max(sum(a.nbytes for a in arrays.values()), 1))
+    spec = {"name": shm.name, "arrays": {}}
+    offset = 0
+    for name, values in arrays.items():
+        view = np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf, offset=offset)
+        view[...] = values
+        spec["arrays"][name] = (values.shape, values.dtype.str, offset)
+        offset += values.nbytes
+    return shm, spec
+
+
+def attach_arrays(spec, writable=False):
+    # pool workers share the parent's resource tracker, so attaching does not
+    # transfer ownership; the creating process unlinks the block
+    shm = shared_memory.SharedMemory(name=spec["name"])
+    arrays = {}
+    for name, (shape, dtype, offset) in spec["arrays"].items():
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        view.flags.writeable = writable
+        arrays[name] = view
+    return shm, arrays
+
+
+_shared = {}
+
+
+def _init_worker(spec):
+    _shared["shm"], _shared["arrays"] = attach_arrays(spec)
+
+
+##############################################################
+# Partitioned CLTV
+##############################################################
+
+def partition_summaries(dataframe, key, today_date, min_customers=50, other_label="Other"):
+    """Per-partition RFM summaries stacked into flat arrays.
+
+    Partitions with fewer than min_customers repeat customers are too small to fit
+    on their own and are pooled into one `other_label` partition; if the pool is
+    still below min_customers its customers are left out.
+    Returns (arrays, labels, bounds): rows of partition i are bounds[i]:bounds[i + 1].
+    """
+    codes, partitions = pd.factorize(dataframe[key].astype(str), sort=True)
+    order = np.argsort(codes, kind="stable")
+    starts = np.searchsorted(codes[order], np.arange(len(partitions) + 1))
+    rows = {partition: order[starts[i]:starts[i + 1]] for i, partition in enumerate(partitions)}
+    summaries = {partition: rfm_summary(dataframe.iloc[idx], today_date) for partition, idx in rows.items()}
+
+    small = [partition for partition, summary in summaries.items()
+             if (summary["frequency"] > 1).sum() < min_customers]
+    if small:
+        pooled = np.sort(np.concatenate([rows[partition] for partition in small]))
+        for partition in small:
+            del summaries[partition]
+        other = rfm_summary(dataframe.iloc[pooled], today_date)
+        if (other["frequency"] > 1).sum() >= min_customers:
+            summaries[other_label] = other
+
+    partitions = list(summaries)
+    bounds = np.cumsum([0] + [len(summary) for summary in summaries.values()])
+    stacked = pd.concat([summary.reset_index() for summary in summaries.values()], ignore_index=True)
+    arrays = {col: stacked[col].to_numpy(dtype="float64") for col in SUMMARY_COLUMNS}
+    return arrays, partitions, bounds
+
+
+def _fit_partition(start, end, month):
+    arrays = _shared["arrays"]
+    cltv_df = pd.DataFrame({col: arrays[col][start:end] for col in SUMMARY_COLUMNS}).set_index("Customer ID")
+    cltv_df["frequency"] = cltv_df["frequency"].astype("int64")
+    return cltv_from_summary(cltv_df, month)
+
+
+def create_cltv_p_partitioned(dataframe, key="Country", month=3, processes=None, min_customers=50,
+                              today_date=TODAY_DATE):
+    """create_cltv_p with one BG/NBD + Gamma-Gamma model per value of `key`.
+
+    dataframe must carry the `key` column (e.g. read with Country, or with a Year
+    column derived from InvoiceDate). Outlier thresholds are computed over the whole
+    frame, as in create_cltv_p; segments are quartiles within each partition.
+    today_date: the date recency and T are counted to.
+    """
+    mask = valid_rows(dataframe)
+    cleaned = clean_chunk(dataframe, valid_thresholds(dataframe, mask), mask)
+
+    arrays, partitions, bounds = partition_summaries(cleaned, key, today_date, min_customers)
+    shm, spec = share_arrays(arrays)
+    try:
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count(),
+                                 initializer=_init_worker, initargs=(spec,)) as executor:
+            futures = [executor.submit(_fit_partition, bounds[i], bounds[i + 1], month)
+                       for i in range(len(partitions))]
+            results = [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    for partition, result in zip(partitions, results):
+        result.insert(0, key, partition)
+    return pd.concat(results, ignore_index=True)
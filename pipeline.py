@@ -0,0 +1,209 @@
+##############################################################
+# CLTV pipeline and command line entry point
+##############################################################
+
+# The functions of "6. Function of the project" in bgnbd&gg.py, importable without
+# running the walkthrough. Nothing here imports matplotlib, sklearn or
+# lifetimes.plotting; lifetimes itself is imported only when a model is fitted.
+#
+#   python pipeline.py datasets/online_retail_II.xlsx --sheet "Year 2009-2010" --month 3 --output cltv.csv
+#   python pipeline.py transactions.parquet --model cltv_model.json --output cltv.parquet
+#   python pipeline.py transactions.parquet --partition-by Country --output cltv_by_country.csv
+#   python pipeline.py history_parts/ --output cltv_out/      (see outofcore.py)
+#   python pipeline.py transactions.parquet --store cltv_store/  (see score_store.py)
+#   python pipeline.py datasets/online_retail_II.xlsx --sheets "Year 2009-2010" "Year 2010-2011" --pipelined
+#                                                                   (see pipelined.py)
+
+import argparse
+import os
+import sys
+
+from cltv import cltv_from_summary, fit_cltv_model
+from ingest import PIPELINE_COLUMNS, iter_transactions, load_transactions
+from instrumentation import NULL_PROFILER, Profiler
+from model_store import load_model
+from preprocessing import clean_chunk, stream_thresholds, valid_rows, valid_thresholds
+from rfm import TODAY_DATE, rfm_summary, streaming_rfm_summary, update_rfm_state
+from segmentation import SegmentCuts, load_cuts
+
+
+def create_cltv_p(dataframe, month=3, model=None, model_path=None, profiler=NULL_PROFILER, segment_cuts=None,
+                  today_date=TODAY_DATE):
+    # model: a CLTVModel (or the path of a saved one) to score with. The fitters
+    # are not touched and the model's cleaning thresholds are reused.
+    # model_path: where to save the model fitted by this run.
+    # profiler: an instrumentation.Profiler that records every stage (see below).
+    # segment_cuts: segmentation.SegmentCuts (or the path of saved ones) to label
+    # with instead of the quartiles of this run, so that segments stay stable.
+    # today_date: the date recency and T are counted to.
+    if isinstance(model, str):
+        model = load_model(model)
+    if isinstance(segment_cuts, str):
+        segment_cuts = load_cuts(segment_cuts)
+
+    with profiler.stage("clean") as info:
+        info["rows_in"] = len(dataframe)
+        # one combined mask; the caller's frame is not modified
+        mask = valid_rows(dataframe)
+        if model is not None and model.thresholds:
+            thresholds = model.thresholds
+        else:
+            thresholds = valid_thresholds(dataframe, mask)
+        dataframe = clean_chunk(dataframe, thresholds, mask)
+        info["rows_out"] = len(dataframe)
+
+    with profiler.stage("rfm") as info:
+        cltv_df = rfm_summary(dataframe, today_date)
+        info.update(rows_in=len(dataframe), rows_out=len(cltv_df))
+    if model is None:
+        model = fit_cltv_model(cltv_df, thresholds, profiler=profiler)
+        if model_path is not None:
+            model.save(model_path)
+    edges = segment_cuts.edges if segment_cuts is not None else None
+    return cltv_from_summary(cltv_df, month, model=model, profiler=profiler, edges=edges)
+
+
+def create_cltv_p_streaming(path, month=3, sheet_name=None, chunksize=500_000, thresholds="sketch",
+                            today_date=TODAY_DATE):
+    # Reads the transactions chunk by chunk; only the per-customer summary is kept
+    # in memory. thresholds: "sketch" (approximate quantiles) or "exact" take an
+    # extra pass over the file, a dict of limits is used as is, None skips clipping.
+    if isinstance(thresholds, str):
+        chunks = iter_transactions(path, chunksize=chunksize, sheet_name=sheet_name)
+        thresholds = stream_thresholds(chunks, method=thresholds)
+    chunks = iter_transactions(path, chunksize=chunksize, sheet_name=sheet_name)
+    cltv_df = streaming_rfm_summary(chunks, today_date, thresholds)
+    return cltv_from_summary(cltv_df, month)
+
+
+def refresh_cltv_p(state_path, delta, today_date, month=3, thresholds=None, bgf_params=None):
+    # Nightly refresh: only the new invoices in `delta` are read; the rest of the
+    # history lives in the per-customer state file at state_path.
+    accumulator = update_rfm_state(state_path, delta, thresholds)
+    return cltv_from_summary(accumulator.summary(today_date), month, bgf_params)
+
+
+##############################################################
+# Command line
+##############################################################
+
+def write_output(cltv_final, path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        cltv_final.to_parquet(path, index=False)
+    elif extension == ".csv":
+        cltv_final.to_csv(path, index=False)
+    else:
+        raise ValueError(f"unsupported output file: {path}")
+    return path
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="3-month CLTV prediction with BG/NBD and Gamma-Gamma.")
+    parser.add_argument("input", help="transactions: .xlsx (with --sheet), .parquet or .csv, or a directory "
+                                      "written by outofcore.partition_transactions")
+    parser.add_argument("--sheet", help="workbook sheet, e.g. 'Year 2009-2010'")
+    parser.add_argument("--sheets", nargs="+", help="several workbook sheets, read in order as one history; "
+                                                    "invoices repeated in a later sheet are read once "
+                                                    "(with --pipelined)")
+    parser.add_argument("--month", type=int, default=3, help="CLTV horizon in months (default: 3)")
+    parser.add_argument("--output", help=".csv or .parquet; without it the top customers are printed")
+    parser.add_argument("--store", help="also write a memory-mapped score store to this directory (score_store.py)")
+    parser.add_argument("--model", help="score with this saved model instead of fitting")
+    parser.add_argument("--save-model", help="save the fitted model to this JSON path")
+    parser.add_argument("--segment-cuts", help="label with the cut points saved in this JSON file")
+    parser.add_argument("--save-segment-cuts", help="save this run's segment cut points to this JSON path")
+    parser.add_argument("--compact", action="store_true",
+                        help="hold the transactions with compact dtypes (categorical, int32, float32)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="read the input chunk by chunk (sketch outlier thresholds)")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="read, clean, fold, score and write in overlapping stages (exact thresholds)")
+    parser.add_argument("--chunksize", type=int, default=500_000)
+    parser.add_argument("--partition-by", help="fit one model per value of this column (e.g. Country)")
+    parser.add_argument("--processes", type=int, help="worker processes for --partition-by and directory input")
+    parser.add_argument("--profile", action="store_true", help="print per-stage timings to stderr")
+    parser.add_argument("--profile-jsonl", help="append per-stage records to this JSON lines file")
+    parser.add_argument("--prometheus", help="write per-stage metrics to this Prometheus text file")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    out_of_core = os.path.isdir(args.input)
+    if args.model and (args.streaming or args.partition_by or out_of_core):
+        parser.error("--model can only be used with the in-memory pipeline")
+    if (args.segment_cuts or args.save_segment_cuts) and (args.streaming or args.partition_by):
+        parser.error("segment cut points apply to the in-memory and directory pipelines")
+    if args.sheets and not args.pipelined:
+        parser.error("--sheets needs --pipelined")
+    if args.pipelined and (args.streaming or args.partition_by or out_of_core):
+        parser.error("--pipelined reads files, without --streaming or --partition-by")
+    if out_of_core:
+        from outofcore import create_cltv_p_out_of_core
+
+        if not args.output:
+            parser.error("a partitioned input directory needs --output DIR")
+        segments = load_cuts(args.segment_cuts) if args.segment_cuts else "exact"
+        create_cltv_p_out_of_core(args.input, args.output, args.month, processes=args.processes,
+                                  compact=args.compact, model_path=args.save_model, segments=segments)
+        if args.save_segment_cuts:
+            load_cuts(os.path.join(args.output, "segments.json")).save(args.save_segment_cuts)
+        if args.store:
+            from outofcore import read_scores
+            from score_store import write_score_store
+
+            write_score_store(read_scores(args.output), args.store)
+        return 0
+    instrumented = args.profile or args.profile_jsonl or args.prometheus
+    profiler = Profiler({"input": os.path.basename(args.input)}) if instrumented else NULL_PROFILER
+
+    if args.pipelined:
+        from pipelined import create_cltv_p_pipelined
+
+        inputs = [(args.input, sheet_name) for sheet_name in args.sheets or [args.sheet]]
+        cltv_final = create_cltv_p_pipelined(inputs, args.month, args.model, args.save_model,
+                                             chunksize=args.chunksize, segment_cuts=args.segment_cuts,
+                                             profiler=profiler)
+        if args.save_segment_cuts:
+            cuts = load_cuts(args.segment_cuts) if args.segment_cuts else SegmentCuts.from_clv(cltv_final["clv"])
+            cuts.save(args.save_segment_cuts)
+    elif args.streaming:
+        cltv_final = create_cltv_p_streaming(args.input, args.month, args.sheet, args.chunksize)
+    elif args.partition_by:
+        from parallel import create_cltv_p_partitioned
+
+        dataframe = load_transactions(args.input, args.sheet, PIPELINE_COLUMNS + [args.partition_by],
+                                      compact=args.compact)
+        cltv_final = create_cltv_p_partitioned(dataframe, args.partition_by, args.month, args.processes)
+    else:
+        with profiler.stage("load") as info:
+            dataframe = load_transactions(args.input, args.sheet, compact=args.compact)
+            info["rows_out"] = len(dataframe)
+        cltv_final = create_cltv_p(dataframe, args.month, args.model, args.save_model, profiler, args.segment_cuts)
+        if args.save_segment_cuts:
+            cuts = load_cuts(args.segment_cuts) if args.segment_cuts else SegmentCuts.from_clv(cltv_final["clv"])
+            cuts.save(args.save_segment_cuts)
+
+    if args.store:
+        from score_store import write_score_store
+
+        write_score_store(cltv_final, args.store)
+    if args.output:
+        write_output(cltv_final, args.output)
+    elif not args.store:
+        print(cltv_final.sort_values("clv", ascending=False).head(10).to_string(index=False))
+
+    if args.profile:
+        print(profiler.format(), file=sys.stderr)
+    if args.profile_jsonl:
+        profiler.to_jsonl(args.profile_jsonl)
+    if args.prometheus:
+        profiler.to_prometheus(args.prometheus)
+    return 0
+
+
+# the guard also keeps spawned --partition-by workers from re-running the CLI
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,348 @@
+##############################################################
+# Pipelined CLTV run
+##############################################################
+
+# create_cltv_p as stages connected by bounded queues, so that reading, cleaning
+# and folding overlap instead of running one after the other:
+#
+#   convert   workbook sheets -> Parquet cache, every sheet at once   (process pool)
+#   read      the inputs chunk by chunk, in order                     (thread)
+#   clean     clean_chunk of several chunks at a time                 (thread pool)
+#   fold      RFMAccumulator.update, in stream order                  (thread)
+#   score     predict_cltv of blocks of customers                     (thread)
+#   label     segment of every block from the frozen cut points       (thread)
+#   write     one Parquet file per scored block                       (thread)
+#
+# A full queue blocks its producer, so every stage holds at most queue_size
+# chunks whatever the input size, and the wall time tends to the slowest stage.
+# With "exact" or "sketch" thresholds the inputs are read twice (value counts,
+# then clean + fold), both passes pipelined; a model or a dict of thresholds
+# skips the first pass. Scoring starts after the last chunk is folded, since a
+# customer's summary is only final then. Every customer is scored once: without
+# frozen segment cuts the scored blocks feed a CLVSegmenter and are labelled and
+# written once all of them are scored.
+#
+# Inputs are read in order as one history. An invoice is taken from the first
+# input it appears in: the two online_retail_II sheets both hold the invoices of
+# early December 2010, and RFMAccumulator would count them twice. Inputs must
+# therefore not split one invoice's lines between them.
+#
+#   cltv_final = create_cltv_p_pipelined([("online_retail_II.xlsx", "Year 2009-2010"),
+#                                         ("online_retail_II.xlsx", "Year 2010-2011")],
+#                                        output_dir="cltv_parts")
+
+import collections
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from cltv import fit_cltv_model, predict_cltv
+from ingest import convert_sheet, is_cached, iter_transactions, record_sheet, source_fingerprint
+from instrumentation import NULL_PROFILER
+from model_store import load_model
+from preprocessing import (clean_chunk, merge_value_counts, thresholds_from_counts, thresholds_from_sketches,
+                           threshold_sketches, valid_value_counts)
+from rfm import TODAY_DATE, RFMAccumulator
+from segmentation import CLVSegmenter, load_cuts
+
+_DONE = object()
+WORKBOOK_EXTENSIONS = (".xlsx", ".xls")
+
+
+class _Stopped(Exception):
+    pass
+
+
+class _Stages:
+    """Threads joined by bounded queues. The first exception in any stage stops
+    the others and is raised again by join()."""
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.stop = threading.Event()
+        self.errors = []
+        self.busy = collections.defaultdict(float)
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def queue(self):
+        return queue.Queue(self.queue_size)
+
+    def put(self, outbox, item):
+        while not self.stop.is_set():
+            try:
+                outbox.put(item, timeout=0.05)
+                return
+            except queue.Full:
+                pass
+        raise _Stopped
+
+    def items(self, inbox):
+        while True:
+            try:
+                item = inbox.get(timeout=0.05)
+            except queue.Empty:
+                if self.stop.is_set():
+                    raise _Stopped
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def timed(self, name, func, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.busy[name] += time.perf_counter() - started
+
+    def start(self, target, *args):
+        def run():
+            try:
+                target(*args)
+            except _Stopped:
+                pass
+            except BaseException as exc:
+                self.errors.append(exc)
+                self.stop.set()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self.errors:
+            raise self.errors[0]
+
+
+##############################################################
+# Stages
+##############################################################
+
+def _read(stages, inputs, conversions, chunksize, outbox):
+    # invoices of the inputs read so far; a later input's lines of those invoices are dropped
+    seen = pd.Index([])
+    for (path, sheet_name), conversion in zip(inputs, conversions):
+        if conversion is not None:
+            stages.timed("convert", _finish_conversion, path, sheet_name, *conversion)
+        chunks = iter_transactions(path, chunksize=chunksize, sheet_name=sheet_name)
+        invoices = []
+        while (chunk := stages.timed("read", next, chunks, None)) is not None:
+            if len(inputs) > 1:
+                if len(seen):
+                    chunk = stages.timed("read", _drop_seen, chunk, seen)
+                invoices.append(pd.Index(chunk["Invoice"].unique()))
+            stages.put(outbox, chunk)
+        seen = seen.append(invoices).unique() if invoices else seen
+    stages.put(outbox, _DONE)
+
+
+def _drop_seen(chunk, seen):
+    # seen is unique, so get_indexer is a hash lookup (isin on str columns is much slower)
+    repeated = seen.get_indexer(chunk["Invoice"]) >= 0
+    return chunk[~repeated] if repeated.any() else chunk
+
+
+def _map_ordered(stages, name, func, executor, inbox, outbox):
+    # at most queue_size chunks in flight; results leave in input order
+    pending = collections.deque()
+    for item in stages.items(inbox):
+        pending.append(executor.submit(stages.timed, name, func, item))
+        if len(pending) >= stages.queue_size:
+            stages.put(outbox, pending.popleft().result())
+    while pending:
+        stages.put(outbox, pending.popleft().result())
+    stages.put(outbox, _DONE)
+
+
+def _fold(stages, accumulator, inbox):
+    for chunk in stages.items(inbox):
+        stages.timed("fold", accumulator.update, chunk)
+
+
+def _merge_counts(stages, merged, inbox):
+    for part in stages.items(inbox):
+        merged.append(stages.timed("merge", merge_value_counts, merged[-1:] + [part]))
+        del merged[:-1]
+
+
+def _merge_sketches(stages, merged, inbox):
+    def merge(part):
+        if not merged:
+            merged.append(part)
+        else:
+            for variable, sketch in part.items():
+                merged[0][variable].merge(sketch)
+
+    for part in stages.items(inbox):
+        stages.timed("merge", merge, part)
+
+
+def _blocks(cltv_df, block_size):
+    for start in range(0, len(cltv_df), block_size):
+        yield cltv_df.iloc[start:start + block_size]
+
+
+def _score(stages, blocks, model, month, outbox):
+    for block in blocks:
+        stages.put(outbox, stages.timed("score", predict_cltv, block, model, month))
+    stages.put(outbox, _DONE)
+
+
+def _emit(stages, items, outbox):
+    for item in items:
+        stages.put(outbox, item)
+    stages.put(outbox, _DONE)
+
+
+def _label(stages, cuts, inbox, outbox):
+    def label(cltv_final):
+        cltv_final["segment"] = cuts.segment(cltv_final["clv"])
+        return cltv_final
+
+    for cltv_final in stages.items(inbox):
+        stages.put(outbox, stages.timed("label", label, cltv_final))
+    stages.put(outbox, _DONE)
+
+
+def _write(stages, output_dir, inbox, parts):
+    for i, cltv_final in enumerate(stages.items(inbox)):
+        if output_dir is not None:
+            path = os.path.join(output_dir, f"part-{i:05d}.parquet")
+            stages.timed("write", cltv_final.to_parquet, path, index=False)
+        parts.append(cltv_final)
+
+
+##############################################################
+# Pipeline
+##############################################################
+
+def _convert_workbooks(inputs, workers):
+    """Start converting every uncached workbook sheet; one (future, fingerprint)
+    (or None) per input. The workers only write the Parquet files; the manifest
+    is updated by _finish_conversion in this process."""
+    uncached = [(path, sheet_name) for path, sheet_name in inputs
+                if os.path.splitext(path)[1].lower() in WORKBOOK_EXTENSIONS and not is_cached(path, sheet_name)]
+    if not uncached:
+        return None, [None] * len(inputs)
+    fingerprints = {path: source_fingerprint(path) for path, _ in uncached}
+    executor = ProcessPoolExecutor(max_workers=min(len(uncached), workers))
+    futures = {key: executor.submit(convert_sheet, *key) for key in dict.fromkeys(uncached)}
+    return executor, [(futures[key], fingerprints[key[0]]) if key in futures else None for key in inputs]
+
+
+def _finish_conversion(path, sheet_name, future, fingerprint):
+    rows = future.result()
+    # the counting pass already recorded it
+    if not is_cached(path, sheet_name):
+        record_sheet(path, sheet_name, rows, fingerprint)
+
+
+def _pass(inputs, conversions, chunksize, queue_size, workers, func, name, consume, *consume_args):
+    """read -> func on a thread pool -> consume, all running at once."""
+    stages = _Stages(queue_size)
+    raw, mapped = stages.queue(), stages.queue()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        stages.start(_read, stages, inputs, conversions, chunksize, raw)
+        stages.start(_map_ordered, stages, name, func, executor, raw, mapped)
+        stages.start(consume, stages, *consume_args, mapped)
+        try:
+            stages.join()
+        finally:
+            stages.stop.set()
+    return stages.busy
+
+
+def create_cltv_p_pipelined(inputs, month=3, model=None, model_path=None, thresholds="exact", output_dir=None,
+                            chunksize=500_000, queue_size=4, workers=None, block_size=100_000,
+                            segment_cuts=None, profiler=NULL_PROFILER, today_date=TODAY_DATE):
+    """create_cltv_p over one or more inputs (paths, or (workbook, sheet) pairs read
+    one after the other as a single history, every invoice from the first input
+    that holds it), with its stages overlapped.
+
+    model: a CLTVModel (or path) to score with; its thresholds are reused.
+    model_path: where to save the model fitted by this run.
+    thresholds: "exact" (as create_cltv_p), "sketch", or a dict of limits.
+    output_dir: also write the scored customers as output_dir/part-NNNNN.parquet,
+    block_size customers per file, while the next block is scored.
+    segment_cuts: frozen segmentation.SegmentCuts (or path) instead of the quartiles
+    of this run. profiler records the thresholds / clean_fold / score_write stages
+    (and the fit) with every stage's busy seconds. today_date: the date recency
+    and T are counted to. Returns the same table as create_cltv_p.
+    """
+    inputs = [(item, None) if isinstance(item, str) else tuple(item) for item in inputs]
+    workers = workers or min(4, os.cpu_count() or 1)
+    if isinstance(model, str):
+        model = load_model(model)
+    if isinstance(segment_cuts, str):
+        segment_cuts = load_cuts(segment_cuts)
+    if model is not None and model.thresholds:
+        thresholds = model.thresholds
+
+    executor, conversions = _convert_workbooks(inputs, workers)
+    try:
+        if isinstance(thresholds, str):
+            with profiler.stage("thresholds") as info:
+                merged = []
+                if thresholds == "exact":
+                    busy = _pass(inputs, conversions, chunksize, queue_size, workers, valid_value_counts, "count",
+                                 _merge_counts, merged)
+                    thresholds = thresholds_from_counts(merged[0])
+                elif thresholds == "sketch":
+                    busy = _pass(inputs, conversions, chunksize, queue_size, workers,
+                                 lambda chunk: threshold_sketches([chunk]), "count", _merge_sketches, merged)
+                    thresholds = thresholds_from_sketches(merged[0])
+                else:
+                    raise ValueError(f"unknown threshold method: {thresholds}")
+                info.update({f"busy_{name}_s": seconds for name, seconds in busy.items()})
+
+        with profiler.stage("clean_fold") as info:
+            accumulator = RFMAccumulator()
+            busy = _pass(inputs, conversions, chunksize, queue_size, workers,
+                         lambda chunk: clean_chunk(chunk, thresholds), "clean", _fold, accumulator)
+            cltv_df = accumulator.summary(today_date)
+            info.update({f"busy_{name}_s": seconds for name, seconds in busy.items()})
+            info["rows_out"] = len(cltv_df)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if model is None:
+        model = fit_cltv_model(cltv_df, thresholds, profiler=profiler)
+        if model_path is not None:
+            model.save(model_path)
+
+    with profiler.stage("score_write") as info:
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+        stages = _Stages(queue_size)
+        scored, labelled, parts = stages.queue(), stages.queue(), []
+        if segment_cuts is None:
+            # the cut points need every CLV: score all blocks first, keeping them
+            segmenter = CLVSegmenter(method="exact")
+            blocks = []
+            for block in _blocks(cltv_df, block_size):
+                blocks.append(stages.timed("score", predict_cltv, block, model, month))
+                stages.timed("segment", segmenter.update, blocks[-1]["clv"])
+            segment_cuts = segmenter.freeze()
+            stages.start(_emit, stages, blocks, scored)
+        else:
+            stages.start(_score, stages, _blocks(cltv_df, block_size), model, month, scored)
+        stages.start(_label, stages, segment_cuts, scored, labelled)
+        stages.start(_write, stages, output_dir, labelled, parts)
+        try:
+            stages.join()
+        finally:
+            stages.stop.set()
+        cltv_final = pd.concat(parts, ignore_index=True)
+        info.update({f"busy_{name}_s": seconds for name, seconds in stages.busy.items()})
+        info.update(rows_in=len(cltv_df), rows_out=len(cltv_final))
+    return cltv_final
@@ -0,0 +1,152 @@
+##############################################################
+# Memoized predictions
+##############################################################
+
+# Reruns and what-if queries score mostly the same customers with the same
+# parameters. PredictionCache keeps the scores of every distinct
+# (frequency, recency, T, monetary) profile under a key made of a digest of the
+# fitted parameters and the query (month, discount rate, horizons), so a repeated
+# query only computes the profiles it has not seen. The in-memory tier is an LRU
+# bounded by max_entries; with a path, scores are also written through to a
+# SQLite file that outlives the process and backs the memory tier.
+#
+#   cache = PredictionCache(max_entries=500_000, path="cltv_predictions.sqlite")
+#   cltv_final = score_cltv(cltv_df, model, month=6, cache=cache)
+#   cache.stats()
+
+import collections
+import hashlib
+import sqlite3
+
+import numpy as np
+
+from cltv import score_profiles
+
+PROFILE_KEY = np.dtype((np.void, 4 * 8))
+# bound parameters per SELECT, under SQLite's default limit
+SQLITE_BATCH = 900
+
+
+def query_namespace(model, month, discount_rate, horizons, dtype="float64"):
+    """Digest of everything besides the profile that the scores depend on."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.dtype(dtype).str.encode())
+    digest.update(np.asarray(model.bgnbd_params + model.gamma_gamma_params, dtype="float64").tobytes())
+    digest.update(np.asarray([month, discount_rate], dtype="float64").tobytes())
+    digest.update(np.asarray(horizons, dtype="float64").tobytes())
+    return digest.digest()
+
+
+class PredictionCache:
+    """LRU of score_profiles results per distinct profile, with an optional SQLite tier.
+
+    Statistics count distinct profiles per call: a hit was served from memory, a
+    disk hit from the SQLite file, a miss was computed.
+    """
+
+    def __init__(self, max_entries=1_000_000, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = collections.OrderedDict()
+        self.hits = self.disk_hits = self.misses = self.evictions = 0
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path)
+            self._db.execute("CREATE TABLE IF NOT EXISTS predictions (namespace BLOB, profile BLOB, scores BLOB, "
+                             "PRIMARY KEY (namespace, profile)) WITHOUT ROWID")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {"entries": len(self._entries), "max_entries": self.max_entries,
+                "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else None}
+
+    def clear(self, disk=False):
+        self._entries.clear()
+        if disk and self._db is not None:
+            self._db.execute("DELETE FROM predictions")
+            self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _load(self, namespace, keys):
+        found = {}
+        for start in range(0, len(keys), SQLITE_BATCH):
+            batch = keys[start:start + SQLITE_BATCH]
+            found.update(self._db.execute(
+                f"SELECT profile, scores FROM predictions WHERE namespace = ? "
+                f"AND profile IN ({', '.join('?' * len(batch))})", [namespace] + batch))
+        return found
+
+    def _store(self, namespace, keys, values):
+        entries = self._entries
+        for key, value in zip(keys, values):
+            entries[namespace, key] = value
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def score_profiles(self, model, frequency, recency, T, monetary, month=3, horizons=(1, 4, 12),
+                       discount_rate=0.01, dtype="float64"):
+        """cltv.score_profiles, computing only the profiles not cached for this
+        model and query (dtype included). Scores are stored as float64 and
+        returned in dtype."""
+        profiles = np.column_stack([np.asarray(v, dtype="float64") for v in (frequency, recency, T, monetary)])
+        keys, inverse = np.unique(profiles.view(PROFILE_KEY).ravel(), return_inverse=True)
+        keys = keys.tolist()
+        namespace = query_namespace(model, month, discount_rate, horizons, dtype)
+        width = len(horizons) + 2
+        scores = np.empty((len(keys), width))
+
+        entries = self._entries
+        hit_rows, hit_values, missing = [], [], []
+        for i, key in enumerate(keys):
+            value = entries.get((namespace, key))
+            if value is None:
+                missing.append(i)
+            else:
+                entries.move_to_end((namespace, key))
+                hit_rows.append(i)
+                hit_values.append(value)
+        self.hits += len(hit_rows)
+
+        if missing and self._db is not None:
+            found = self._load(namespace, [keys[i] for i in missing])
+            if found:
+                loaded = [i for i in missing if keys[i] in found]
+                values = [found[keys[i]] for i in loaded]
+                self._store(namespace, [keys[i] for i in loaded], values)
+                hit_rows += loaded
+                hit_values += values
+                self.disk_hits += len(loaded)
+                missing = [i for i in missing if keys[i] not in found]
+        if hit_rows:
+            scores[hit_rows] = np.frombuffer(b"".join(hit_values), dtype="float64").reshape(-1, width)
+
+        if missing:
+            self.misses += len(missing)
+            computed = np.frombuffer(b"".join(keys[i] for i in missing), dtype="float64").reshape(-1, 4)
+            result = score_profiles(model, *computed.T, month=month, horizons=horizons, discount_rate=discount_rate,
+                                    dtype=dtype)
+            computed = np.column_stack([result["expected_purchases"], result["expected_average_profit"],
+                                        result["clv"]]).astype("float64")
+            scores[missing] = computed
+            values = np.ascontiguousarray(computed).view(np.dtype((np.void, 8 * width))).ravel().tolist()
+            missing_keys = [keys[i] for i in missing]
+            self._store(namespace, missing_keys, values)
+            if self._db is not None:
+                self._db.executemany("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)",
+                                     [(namespace, key, value) for key, value in zip(missing_keys, values)])
+                self._db.commit()
+
+        scores = scores[inverse.ravel()].astype(dtype, copy=False)
+        return {"expected_purchases": scores[:, :len(horizons)],
+                "expected_average_profit": scores[:, -2],
+                "clv": scores[:, -1]}
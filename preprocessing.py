@@ -0,0 +1,184 @@
+##############################################################
+# Cleaning rules shared by the in-memory and streaming paths
+##############################################################
+
+import numpy as np
+import pandas as pd
+
+from sketch import KLLSketch
+
+OUTLIER_VARIABLES = ("Quantity", "Price")
+
+
+def limits_from_quantiles(quartile1, quartile3):
+    interquantile_range = quartile3 - quartile1
+    up_limit = quartile3 + 1.5 * interquantile_range
+    low_limit = quartile1 - 1.5 * interquantile_range
+    return low_limit, up_limit
+
+
+def outlier_thresholds(dataframe, variable):
+    quartile1 = dataframe[variable].quantile(0.01)
+    quartile3 = dataframe[variable].quantile(0.99)
+    return limits_from_quantiles(quartile1, quartile3)
+
+
+def clip_dtype(values):
+    # clipped values can fall between integers; compact (32-bit) columns stay 32-bit
+    return "float32" if values.dtype.itemsize <= 4 else "float64"
+
+
+def replace_with_thresholds(dataframe, variable, limits=None):
+    # limits: (low_limit, up_limit) from stream_thresholds; by default the exact
+    # quantiles of the column are used
+    low_limit, up_limit = limits if limits is not None else outlier_thresholds(dataframe, variable)
+    values = dataframe[variable]
+    dataframe[variable] = values.astype(clip_dtype(values)).clip(low_limit, up_limit)
+
+
+def cancelled(dataframe):
+    # compact frames carry the flag precomputed (ingest.compact_transactions)
+    if "Cancelled" in dataframe.columns:
+        return dataframe["Cancelled"]
+    return dataframe["Invoice"].str.contains("C", na=False)
+
+
+def valid_rows(dataframe):
+    """Boolean mask of the rows drop_invalid keeps: no missing value, not cancelled,
+    positive Quantity and Price. Built column by column, without filtered copies."""
+    mask = np.ones(len(dataframe), dtype=bool)
+    for col in dataframe.columns:
+        mask &= dataframe[col].notna().to_numpy()
+    mask &= ~np.asarray(cancelled(dataframe), dtype=bool)
+    mask &= dataframe["Quantity"].to_numpy() > 0
+    mask &= dataframe["Price"].to_numpy() > 0
+    return mask
+
+
+def drop_invalid(dataframe):
+    return dataframe[valid_rows(dataframe)]
+
+
+def valid_thresholds(dataframe, mask=None, variables=OUTLIER_VARIABLES):
+    """outlier_thresholds of every variable over the valid rows only."""
+    mask = valid_rows(dataframe) if mask is None else mask
+    return {variable: outlier_thresholds(pd.DataFrame({variable: dataframe[variable].to_numpy()[mask]},
+                                                      copy=False), variable)
+            for variable in variables}
+
+
+def clean_chunk(dataframe, thresholds=None, mask=None):
+    """Apply the cleaning rules to one chunk and add TotalPrice.
+
+    thresholds: {"Quantity": (low_limit, up_limit), "Price": (...)} computed over
+    the whole history; quantiles of a single chunk would differ from the global ones.
+    mask: valid_rows(dataframe), if the caller already has it.
+
+    Every column is gathered once with the combined mask and the clipped columns are
+    clipped in place in that copy; the input frame is never modified.
+    """
+    mask = valid_rows(dataframe) if mask is None else mask
+    thresholds = thresholds or {}
+    columns = {}
+    for col in dataframe.columns:
+        if col in thresholds:
+            values = dataframe[col].to_numpy()[mask].astype(clip_dtype(dataframe[col]), copy=False)
+            np.clip(values, *thresholds[col], out=values)
+            columns[col] = values
+        else:
+            columns[col] = dataframe[col].array[mask]
+    columns["TotalPrice"] = np.multiply(np.asarray(columns["Quantity"]), np.asarray(columns["Price"]))
+    return pd.DataFrame(columns, index=dataframe.index[mask], copy=False)
+
+
+##############################################################
+# Exact thresholds from value counts
+##############################################################
+
+# Quantity and Price take few distinct values (integers, prices in cents), so
+# their value counts are small even for billions of lines. Counts from separate
+# chunks or partitions add up, and the quantiles of the whole history follow
+# exactly from the merged counts.
+
+def valid_value_counts(dataframe, mask=None, variables=OUTLIER_VARIABLES):
+    """{variable: (sorted distinct values, counts)} over the valid rows."""
+    mask = valid_rows(dataframe) if mask is None else mask
+    return {variable: np.unique(dataframe[variable].to_numpy()[mask], return_counts=True) for variable in variables}
+
+
+def merge_value_counts(parts):
+    merged = {}
+    for variable in parts[0]:
+        values = np.concatenate([part[variable][0] for part in parts])
+        counts = np.concatenate([part[variable][1] for part in parts])
+        distinct, inverse = np.unique(values, return_inverse=True)
+        merged[variable] = (distinct, np.bincount(inverse, weights=counts).astype("int64"))
+    return merged
+
+
+def quantile_from_counts(values, counts, q):
+    """Series.quantile(q) (linear interpolation) of the sample holding values[i]
+    counts[i] times; values sorted. Same arithmetic as numpy's linear method."""
+    cumulative = np.cumsum(counts)
+    position = (cumulative[-1] - 1) * np.asarray(q, dtype="float64")
+    lower = np.floor(position)
+    fraction = position - lower
+    lower = lower.astype("int64")
+    upper = np.minimum(lower + 1, cumulative[-1] - 1)
+    below = values[np.searchsorted(cumulative, lower, side="right")]
+    above = values[np.searchsorted(cumulative, upper, side="right")]
+    difference = above - below
+    return np.where(fraction >= 0.5, above - difference * (1 - fraction), below + difference * fraction)
+
+
+def thresholds_from_counts(value_counts):
+    thresholds = {}
+    for variable, (values, counts) in value_counts.items():
+        quartile1, quartile3 = quantile_from_counts(values, counts, [0.01, 0.99])
+        thresholds[variable] = limits_from_quantiles(float(quartile1), float(quartile3))
+    return thresholds
+
+
+##############################################################
+# Outlier thresholds over a stream of chunks
+##############################################################
+
+def threshold_sketches(chunks, variables=OUTLIER_VARIABLES, k=2000, seed=None):
+    """One KLLSketch per variable, fed with the valid rows of every chunk.
+
+    Sketches built on different workers can be combined with KLLSketch.merge
+    before calling thresholds_from_sketches.
+    """
+    sketches = {variable: KLLSketch(k=k, seed=seed) for variable in variables}
+    for chunk in chunks:
+        chunk = drop_invalid(chunk)
+        for variable in variables:
+            sketches[variable].update(chunk[variable].to_numpy(dtype="float64"))
+    return sketches
+
+
+def thresholds_from_sketches(sketches):
+    thresholds = {}
+    for variable, sketch in sketches.items():
+        quartile1, quartile3 = sketch.quantile([0.01, 0.99])
+        thresholds[variable] = limits_from_quantiles(float(quartile1), float(quartile3))
+    return thresholds
+
+
+def stream_thresholds(chunks, variables=OUTLIER_VARIABLES, method="sketch", k=2000, seed=None):
+    """{variable: (low_limit, up_limit)} over all chunks.
+
+    method="exact" keeps the valid values of each variable and reproduces
+    outlier_thresholds on the concatenated history; "sketch" needs O(k) memory.
+    """
+    if method == "sketch":
+        return thresholds_from_sketches(threshold_sketches(chunks, variables, k, seed))
+    if method != "exact":
+        raise ValueError(f"unknown threshold method: {method}")
+    values = {variable: [] for variable in variables}
+    for chunk in chunks:
+        chunk = drop_invalid(chunk)
+        for variable in variables:
+            values[variable].append(chunk[variable].to_numpy())
+    return {variable: outlier_thresholds(pd.DataFrame({variable: np.concatenate(parts)}), variable)
+            for variable, parts in values.items()}
@@ -0,0 +1,260 @@
+##############################################################
+# Recency / T / Frequency / Monetary summary
+##############################################################
+
+# Vectorized replacement for
+#   df.groupby('Customer ID').agg({'InvoiceDate': [lambda d: (d.max() - d.min()).days,
+#                                                  lambda d: (today_date - d.min()).days],
+#                                  'Invoice': lambda num: num.nunique(),
+#                                  'TotalPrice': lambda TotalPrice: TotalPrice.sum()})
+# Customers and invoices are integer-encoded, rows are sorted by customer once and
+# every statistic is a segment reduction over the sorted arrays.
+
+import datetime as dt
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from preprocessing import clean_chunk
+
+NS_PER_DAY = 86_400 * 10 ** 9
+# analysis date of the project, two days after the last invoice of online_retail_II;
+# every pipeline computes recency and T against it unless given another one
+TODAY_DATE = dt.datetime(2011, 12, 11)
+
+
+def to_epoch_ns(dates):
+    dates = np.asarray(dates)
+    if dates.dtype.kind in "iu":
+        # compact frames store InvoiceDate as minutes since the epoch (ingest.compact_transactions)
+        dates = dates.astype("int64").astype("datetime64[m]")
+    return dates.astype("datetime64[ns]").view("int64")
+
+
+def _encode(dataframe, customer_col, sort):
+    cust_codes, customers = pd.factorize(dataframe[customer_col], sort=sort)
+    inv_codes, invoices = pd.factorize(dataframe["Invoice"])
+    dates = to_epoch_ns(dataframe["InvoiceDate"].to_numpy())
+    total_price = dataframe["TotalPrice"].to_numpy(dtype="float64")
+
+    # groupby drops missing keys
+    valid = cust_codes >= 0
+    if not valid.all():
+        cust_codes, inv_codes = cust_codes[valid], inv_codes[valid]
+        dates, total_price = dates[valid], total_price[valid]
+    return cust_codes, customers, inv_codes, invoices, dates, total_price
+
+
+def _segment_stats(cust_codes, n_customers, inv_codes, n_invoices, dates, total_price):
+    if n_customers == 0:
+        empty = np.array([], dtype="int64")
+        return empty, empty, empty, np.array([], dtype="float64"), empty, empty
+
+    order = np.argsort(cust_codes, kind="stable")
+    sorted_codes = cust_codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    ends = np.r_[starts[1:], len(order)] - 1
+    sorted_dates = dates[order]
+    first = np.minimum.reduceat(sorted_dates, starts)
+    last = np.maximum.reduceat(sorted_dates, starts)
+
+    # distinct (customer, invoice) pairs; nunique ignores missing invoices
+    has_invoice = inv_codes >= 0
+    n_invoices = max(n_invoices, 1)
+    pair_keys = np.unique(cust_codes[has_invoice].astype("int64") * n_invoices + inv_codes[has_invoice])
+    frequency = np.bincount(pair_keys // n_invoices, minlength=n_customers).astype("int64")
+
+    monetary = np.bincount(cust_codes, weights=total_price, minlength=n_customers)
+
+    # invoice on each customer's first and last line, in stream order
+    first_invoice = inv_codes[order][starts]
+    last_invoice = inv_codes[order][ends]
+    return first, last, frequency, monetary, first_invoice, last_invoice
+
+
+def summary_frame(customers, first, last, frequency, monetary, today_date, customer_col="Customer ID"):
+    today = to_epoch_ns(np.datetime64(pd.Timestamp(today_date), "ns"))
+    # day counts and invoice counts fit in int32; monetary stays float64
+    return pd.DataFrame({"recency": ((last - first) // NS_PER_DAY).astype("int32"),
+                         "T": ((today - first) // NS_PER_DAY).astype("int32"),
+                         "frequency": frequency.astype("int32"),
+                         "monetary": monetary},
+                        index=pd.Index(customers, name=customer_col))
+
+
+def rfm_summary(dataframe, today_date, customer_col="Customer ID"):
+    """recency and T in days, frequency = distinct invoices, monetary = total spend."""
+    cust_codes, customers, inv_codes, invoices, dates, total_price = _encode(dataframe, customer_col, sort=True)
+    first, last, frequency, monetary, _, _ = _segment_stats(cust_codes, len(customers),
+                                                            inv_codes, len(invoices),
+                                                            dates, total_price)
+    return summary_frame(customers, first, last, frequency, monetary, today_date, customer_col)
+
+
+##############################################################
+# Streaming summary
+##############################################################
+
+class RFMAccumulator:
+    """Running per-customer first/last date, distinct invoice count and revenue.
+
+    Memory grows with the number of customers, not with transaction lines. The lines
+    of one invoice are expected to be contiguous in the stream (the workbook is
+    ordered by invoice), so remembering each customer's last invoice is enough to
+    count an invoice split across two chunks only once.
+    """
+
+    def __init__(self, customer_col="Customer ID"):
+        self.customer_col = customer_col
+        self.customers = pd.Index([], dtype="float64", name=customer_col)
+        self.first = np.empty(0, dtype="int64")
+        self.last = np.empty(0, dtype="int64")
+        self.frequency = np.empty(0, dtype="int64")
+        self.monetary = np.empty(0, dtype="float64")
+        self.last_invoice = np.empty(0, dtype=object)
+
+    def __len__(self):
+        return len(self.customers)
+
+    def _positions(self, customers):
+        positions = self.customers.get_indexer(customers)
+        new = positions < 0
+        if new.any():
+            n_new = int(new.sum())
+            positions[new] = np.arange(len(self.customers), len(self.customers) + n_new)
+            self.customers = self.customers.append(pd.Index(customers[new], name=self.customer_col))
+            self.first = np.r_[self.first, np.full(n_new, np.iinfo("int64").max)]
+            self.last = np.r_[self.last, np.full(n_new, np.iinfo("int64").min)]
+            self.frequency = np.r_[self.frequency, np.zeros(n_new, dtype="int64")]
+            self.monetary = np.r_[self.monetary, np.zeros(n_new)]
+            self.last_invoice = np.r_[self.last_invoice, np.full(n_new, None, dtype=object)]
+        return positions
+
+    def update(self, dataframe):
+        """Fold one cleaned chunk (with TotalPrice) into the state."""
+        cust_codes, customers, inv_codes, invoices, dates, total_price = _encode(dataframe, self.customer_col,
+                                                                                 sort=False)
+        if len(customers) == 0:
+            return self
+        first, last, frequency, monetary, first_invoice, last_invoice = _segment_stats(
+            cust_codes, len(customers), inv_codes, len(invoices), dates, total_price)
+
+        invoices = np.asarray(invoices, dtype=object)
+        positions = self._positions(np.asarray(customers))
+        continued = self.last_invoice[positions] == invoices[first_invoice]
+
+        self.first[positions] = np.minimum(self.first[positions], first)
+        self.last[positions] = np.maximum(self.last[positions], last)
+        self.frequency[positions] += frequency - continued
+        self.monetary[positions] += monetary
+        self.last_invoice[positions] = invoices[last_invoice]
+        return self
+
+    def summary(self, today_date):
+        order = np.argsort(np.asarray(self.customers), kind="stable")
+        return summary_frame(self.customers[order], self.first[order], self.last[order],
+                             self.frequency[order], self.monetary[order], today_date, self.customer_col)
+
+    @property
+    def watermark(self):
+        """Latest InvoiceDate folded in so far."""
+        if len(self) == 0:
+            return None
+        return pd.Timestamp(self.last.max())
+
+    def save(self, path, thresholds=None):
+        # the file is replaced atomically so a failed nightly run keeps yesterday's state
+        last_invoice = np.array(["" if inv is None else str(inv) for inv in self.last_invoice], dtype=str)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f,
+                     customers=np.asarray(self.customers, dtype="float64"),
+                     first=self.first,
+                     last=self.last,
+                     frequency=self.frequency,
+                     monetary=self.monetary,
+                     last_invoice=last_invoice,
+                     meta=np.array(json.dumps({"customer_col": self.customer_col,
+                                               "thresholds": thresholds})))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Returns (accumulator, thresholds) as stored by save()."""
+        with np.load(path, allow_pickle=False) as state:
+            meta = json.loads(str(state["meta"]))
+            accumulator = cls(meta["customer_col"])
+            accumulator.customers = pd.Index(state["customers"], name=accumulator.customer_col)
+            accumulator.first = state["first"]
+            accumulator.last = state["last"]
+            accumulator.frequency = state["frequency"]
+            accumulator.monetary = state["monetary"]
+            accumulator.last_invoice = np.array([inv or None for inv in state["last_invoice"].tolist()],
+                                                dtype=object)
+        thresholds = {variable: tuple(limits) for variable, limits in (meta["thresholds"] or {}).items()}
+        return accumulator, thresholds or None
+
+
+def streaming_rfm_summary(chunks, today_date, thresholds=None, customer_col="Customer ID"):
+    """rfm_summary over an iterable of raw transaction chunks, cleaning each chunk on the way."""
+    accumulator = RFMAccumulator(customer_col)
+    for chunk in chunks:
+        accumulator.update(clean_chunk(chunk, thresholds))
+    return accumulator.summary(today_date)
+
+
+##############################################################
+# Incremental state store
+##############################################################
+
+def update_rfm_state(state_path, delta, thresholds=None, customer_col="Customer ID"):
+    """Fold a batch of new raw transactions into the persisted state at state_path.
+
+    The first call creates the state and freezes `thresholds` in it; later calls
+    reuse the stored thresholds so revenue already accumulated and revenue from new
+    batches are clipped the same way. An invoice whose lines continue from the
+    previous batch is not counted twice. Returns the updated accumulator; call
+    .summary(today_date) on it for the recency/T/frequency/monetary table.
+    """
+    if os.path.exists(state_path):
+        accumulator, thresholds = RFMAccumulator.load(state_path)
+    else:
+        accumulator = RFMAccumulator(customer_col)
+    chunks = [delta] if isinstance(delta, pd.DataFrame) else delta
+    for chunk in chunks:
+        accumulator.update(clean_chunk(chunk, thresholds))
+    accumulator.save(state_path, thresholds)
+    return accumulator
+
+
+##############################################################
+# Sufficient-statistic compression
+##############################################################
+
+def unique_profiles(cltv_df, columns):
+    """Deduplicate cltv_df[columns] for fitting and scoring on distinct profiles.
+
+    Returns (profiles, weights, inverse): the distinct rows, how many customers share
+    each, and for every customer the row of its profile, so per-profile results are
+    scattered back with values[inverse].
+    """
+    values = np.column_stack([cltv_df[col].to_numpy(dtype="float64") for col in columns])
+    profiles, inverse, weights = np.unique(values, axis=0, return_inverse=True, return_counts=True)
+    return pd.DataFrame(profiles, columns=columns), weights, inverse.ravel()
+
+
+def merge_profiles(parts):
+    """Combine (profiles, weights) pairs from several partitions into one.
+
+    Returns (profiles, weights) in the same sorted order unique_profiles gives on the
+    concatenated customers, so a fit on the merged profiles equals the fit on all
+    customers at once.
+    """
+    columns = list(parts[0][0].columns)
+    values = np.concatenate([profiles[columns].to_numpy(dtype="float64") for profiles, _ in parts])
+    counts = np.concatenate([np.asarray(weights) for _, weights in parts])
+    profiles, inverse = np.unique(values, axis=0, return_inverse=True)
+    weights = np.bincount(inverse.ravel(), weights=counts, minlength=len(profiles)).astype("int64")
+    return pd.DataFrame(profiles, columns=columns), weights
@@ -0,0 +1,175 @@
+##############################################################
+# Columnar, memory-mapped customer score store
+##############################################################
+
+# create_cltv_p's output persisted as one .npy file per column, rows sorted by
+# Customer ID, with a small meta.json. Readers open the files with
+# np.load(mmap_mode="r"): a load copies nothing, pages are read on first touch
+# and every process reading the store shares the same page cache.
+#
+#   point lookups   binary search over the sorted Customer ID column, O(log n)
+#   segment scans   segment_order.npy lists the rows grouped by segment, with
+#                   the group offsets in meta.json
+#
+# Text columns (e.g. Country of a --partition-by run) are stored as int32 codes
+# with their labels in meta.json, like the segment, so every file can be mapped.
+#
+# A store is written into a temporary directory and renamed into place, so
+# readers never see a half-written one; readers of the replaced store keep their
+# mapped files until they close them.
+#
+#   write_score_store(cltv_final, "cltv_store")
+#   store = ScoreStore("cltv_store")
+#   store.lookup(12347)
+#   store.segment("A")
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from cltv import SEGMENT_LABELS
+
+FORMAT_VERSION = 2
+ID_COLUMN = "Customer ID"
+
+
+def _column_path(path, name):
+    return os.path.join(path, name.replace(" ", "_") + ".npy")
+
+
+def write_score_store(cltv_final, path, model=None):
+    """Write a create_cltv_p table (Customer ID, the numeric columns, text columns
+    such as Country and the segment) to the directory path; model: the CLTVModel
+    it was scored with, recorded in meta.json."""
+    order = np.argsort(cltv_final[ID_COLUMN].to_numpy(), kind="stable")
+    segment = cltv_final["segment"]
+    labels = list(segment.cat.categories) if isinstance(segment.dtype, pd.CategoricalDtype) else SEGMENT_LABELS
+    codes = pd.Categorical(segment, categories=labels).codes[order].astype("int8")
+    columns = [col for col in cltv_final.columns if col != "segment"]
+
+    tmp_path = path.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    categories = {}
+    for col in columns:
+        values = cltv_final[col].to_numpy()[order]
+        if values.dtype.kind in "OSU":
+            # object arrays cannot be memory-mapped; missing values get code -1
+            col_codes, uniques = pd.factorize(values, sort=True)
+            values = col_codes.astype("int32")
+            categories[col] = [str(label) for label in uniques]
+        np.save(_column_path(tmp_path, col), np.ascontiguousarray(values))
+    np.save(_column_path(tmp_path, "segment"), codes)
+    segment_order = np.argsort(codes, kind="stable")
+    np.save(_column_path(tmp_path, "segment_order"), segment_order)
+    offsets = np.searchsorted(codes[segment_order], np.arange(len(labels) + 1))
+    meta = {"format_version": FORMAT_VERSION,
+            "n_rows": len(cltv_final),
+            "columns": columns + ["segment"],
+            "labels": labels,
+            "categories": categories,
+            "segment_offsets": offsets.tolist(),
+            "model_fingerprint": getattr(model, "fingerprint", None),
+            "model_fitted_at": getattr(model, "fitted_at", None)}
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    if os.path.exists(path):
+        old_path = path.rstrip(os.sep) + ".old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.replace(tmp_path, path)
+    return path
+
+
+class ScoreStore:
+    """Read-only view of a store written by write_score_store."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["format_version"] > FORMAT_VERSION:
+            raise ValueError(f"score store version {self.meta['format_version']} is newer than "
+                             f"supported version {FORMAT_VERSION}")
+        self.columns = self.meta["columns"]
+        self.labels = self.meta["labels"]
+        self.categories = self.meta.get("categories", {})
+        self._arrays = {}
+
+    def __len__(self):
+        return self.meta["n_rows"]
+
+    def __repr__(self):
+        return f"ScoreStore({self.path!r}, n_rows={len(self)})"
+
+    def column(self, name):
+        """The memory-mapped array of one column (segment as int8 codes into labels)."""
+        if name not in self._arrays:
+            if name not in self.columns and name != "segment_order":
+                raise KeyError(name)
+            self._arrays[name] = np.load(_column_path(self.path, name), mmap_mode="r")
+        return self._arrays[name]
+
+    def _decode(self, col, values):
+        if col == "segment":
+            return pd.Categorical.from_codes(values, categories=self.labels, ordered=True)
+        if col in self.categories:
+            return pd.Categorical.from_codes(values, categories=self.categories[col])
+        return values
+
+    def close(self):
+        self._arrays.clear()
+
+    def rows(self, customer_ids):
+        """Row positions of customer_ids, -1 where the customer is not in the store."""
+        ids = self.column(ID_COLUMN)
+        customer_ids = np.atleast_1d(np.asarray(customer_ids, dtype=ids.dtype))
+        positions = np.minimum(np.searchsorted(ids, customer_ids), max(len(ids) - 1, 0))
+        found = (ids[positions] == customer_ids) if len(ids) else np.zeros(len(customer_ids), dtype=bool)
+        return np.where(found, positions, -1)
+
+    def take(self, rows, columns=None):
+        """A DataFrame of the given row positions."""
+        columns = columns or self.columns
+        data = {}
+        for col in columns:
+            data[col] = self._decode(col, self.column(col)[rows])
+        return pd.DataFrame(data, columns=columns)
+
+    def lookup(self, customer_id):
+        """One customer's row as a dict, or None."""
+        ids = self.column(ID_COLUMN)
+        row = int(np.searchsorted(ids, customer_id))
+        if row == len(ids) or ids[row] != customer_id:
+            return None
+        record = {col: self.column(col)[row].item() for col in self.columns}
+        for col, labels in [("segment", self.labels)] + list(self.categories.items()):
+            record[col] = labels[record[col]] if record[col] >= 0 else None
+        return record
+
+    def lookup_many(self, customer_ids, columns=None):
+        """The rows of the customers found, in the order asked."""
+        rows = self.rows(customer_ids)
+        return self.take(rows[rows >= 0], columns)
+
+    def segment(self, label, columns=None):
+        """All customers of one segment, in Customer ID order."""
+        code = self.labels.index(label)
+        offsets = self.meta["segment_offsets"]
+        return self.take(self.column("segment_order")[offsets[code]:offsets[code + 1]], columns)
+
+    def to_frame(self, columns=None):
+        """The whole store; numeric columns are wrapped around the mapped arrays
+        rather than copied."""
+        columns = columns or self.columns
+        data = {}
+        for col in columns:
+            data[col] = self._decode(col, self.column(col))
+        return pd.DataFrame(data, columns=columns, copy=False)
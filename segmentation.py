@@ -0,0 +1,161 @@
+##############################################################
+# Streaming CLV segmentation
+##############################################################
+
+# pd.qcut(clv, 4) and MinMaxScaler need the whole CLV column and a full sort
+# before the first customer is labelled. CLVSegmenter instead takes CLV chunk by
+# chunk (or partition by partition, merging the segmenters of several workers)
+# and keeps min / max exactly and the quantiles in a KLL sketch, or exactly as
+# value counts. The result is a SegmentCuts: cut points plus min / max that
+# label and scale any chunk on its own, and that can be saved and reused so a
+# later or incremental run puts customers into the same segments.
+#
+#   segmenter = CLVSegmenter()
+#   for chunk in chunks:
+#       segmenter.update(chunk["clv"])
+#   cuts = segmenter.freeze()
+#   cuts.save("segment_cuts.json")
+#   for chunk in label_chunks(chunks, cuts):
+#       ...
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from cltv import SEGMENT_LABELS
+from preprocessing import merge_value_counts, quantile_from_counts
+from sketch import KLLSketch
+
+
+class SegmentCuts:
+    """Frozen cut points and min / max of a CLV population.
+
+    segment() gives the labels pd.qcut(clv, len(labels)) gives on that population
+    (bins closed on the right); values outside [minimum, maximum] fall into the
+    lowest / highest segment and NaN is left without one. scale() is MinMaxScaler fitted on that population.
+    """
+
+    def __init__(self, cut_points, minimum, maximum, labels=SEGMENT_LABELS):
+        self.cut_points = np.asarray(cut_points, dtype="float64")
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.labels = list(labels)
+        if len(self.cut_points) != len(self.labels) - 1:
+            raise ValueError(f"{len(self.labels)} labels need {len(self.labels) - 1} cut points")
+
+    def __repr__(self):
+        return f"SegmentCuts(cut_points={self.cut_points.tolist()}, minimum={self.minimum}, maximum={self.maximum})"
+
+    @property
+    def edges(self):
+        # the bin edges of cltv.clv_segments / score_cltv(edges=...)
+        return np.r_[self.minimum, self.cut_points, self.maximum]
+
+    def codes(self, clv):
+        # NaN (unscored) gets -1, a missing segment, as in cltv.clv_segments
+        clv = np.asarray(clv, dtype="float64")
+        return np.where(np.isnan(clv), -1, np.searchsorted(self.cut_points, clv, side="left")).astype("int8")
+
+    def segment(self, clv):
+        return pd.Categorical.from_codes(self.codes(clv), categories=self.labels, ordered=True)
+
+    def scale(self, clv):
+        # MinMaxScaler leaves a constant column at 0
+        spread = self.maximum - self.minimum
+        return (np.asarray(clv, dtype="float64") - self.minimum) / (spread if spread else 1.0)
+
+    def to_dict(self):
+        return {"labels": self.labels, "cut_points": self.cut_points.tolist(),
+                "minimum": self.minimum, "maximum": self.maximum}
+
+    @classmethod
+    def from_dict(cls, artifact):
+        return cls(artifact["cut_points"], artifact["minimum"], artifact["maximum"], artifact["labels"])
+
+    @classmethod
+    def from_clv(cls, clv, labels=SEGMENT_LABELS):
+        """Exact cuts of one in-memory CLV vector."""
+        return CLVSegmenter(labels=labels, method="exact").update(clv).freeze()
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+
+def load_cuts(path):
+    with open(path) as f:
+        return SegmentCuts.from_dict(json.load(f))
+
+
+class CLVSegmenter:
+    """Mergeable quantile cut points and min / max of a stream of CLV values.
+
+    quantiles: the inner cut points as fractions (default: equal-sized segments,
+    the quartiles for four labels). method="sketch" keeps a KLLSketch (rank error
+    about 3.3 / k); "exact" keeps value counts and reproduces np.quantile, hence
+    pd.qcut, over everything seen.
+    """
+
+    def __init__(self, quantiles=None, labels=SEGMENT_LABELS, method="sketch", k=2000, seed=None):
+        if method not in ("sketch", "exact"):
+            raise ValueError(f"unknown segmentation method: {method}")
+        self.labels = list(labels)
+        self.quantiles = (np.linspace(0, 1, len(self.labels) + 1)[1:-1] if quantiles is None
+                          else np.asarray(quantiles, dtype="float64"))
+        self.method = method
+        self.n = 0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self._sketch = KLLSketch(k=k, seed=seed) if method == "sketch" else None
+        self._counts = []
+
+    def update(self, clv):
+        clv = np.asarray(clv, dtype="float64").ravel()
+        clv = clv[~np.isnan(clv)]
+        if not len(clv):
+            return self
+        self.n += len(clv)
+        self.minimum = min(self.minimum, float(clv.min()))
+        self.maximum = max(self.maximum, float(clv.max()))
+        if self._sketch is not None:
+            self._sketch.update(clv)
+        else:
+            self._counts.append({"clv": np.unique(clv, return_counts=True)})
+        return self
+
+    def merge(self, other):
+        if other.method != self.method:
+            raise ValueError("cannot merge segmenters with different methods")
+        self.n += other.n
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        if self._sketch is not None:
+            self._sketch.merge(other._sketch)
+        else:
+            self._counts += other._counts
+        return self
+
+    def freeze(self):
+        if self.n == 0:
+            raise ValueError("no CLV values to segment")
+        if self._sketch is not None:
+            cut_points = self._sketch.quantile(self.quantiles)
+        else:
+            self._counts = [merge_value_counts(self._counts)]
+            values, counts = self._counts[0]["clv"]
+            cut_points = quantile_from_counts(values, counts, self.quantiles)
+        return SegmentCuts(cut_points, self.minimum, self.maximum, self.labels)
+
+
+def label_chunks(chunks, cuts, column="clv"):
+    """Add scaled_clv and segment to every chunk with frozen cuts."""
+    for chunk in chunks:
+        chunk = chunk.copy()
+        chunk["scaled_clv"] = cuts.scale(chunk[column])
+        chunk["segment"] = cuts.segment(chunk[column])
+        yield chunk
@@ -0,0 +1,208 @@
+##############################################################
+# CLTV scoring service
+##############################################################
+
+# Holds a saved CLTVModel in memory and answers per-customer CLTV / segment
+# lookups over TCP or a Unix socket. The protocol is one JSON object per line:
+#   {"customer_id": 12346}
+#   {"frequency": 11, "recency": 28.0, "T": 103.71, "monetary": 33.90}
+#   {"op": "stats"}
+# Known customers are scored once at startup, so an ID lookup is a dict hit.
+# Profile requests that arrive concurrently are coalesced into micro-batches
+# and scored with one vectorized call; with --cache-size, profiles already
+# scored are served from a prediction_cache.PredictionCache.
+#
+#   python server.py --model cltv_model.json --customers cltv_final.parquet --port 8765
+
+import argparse
+import asyncio
+import collections
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from cltv import SEGMENT_LABELS, score_profiles
+from model_store import load_model
+
+PROFILE_FIELDS = ["frequency", "recency", "T", "monetary"]
+
+
+class LatencyStats:
+    def __init__(self, window=100_000):
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.deque(maxlen=window)
+        self.started = time.perf_counter()
+        self.requests = 0
+
+    def record(self, seconds):
+        self.latencies.append(seconds)
+        self.requests += 1
+
+    def summary(self):
+        latencies = np.fromiter(self.latencies, dtype="float64") * 1e6
+        elapsed = time.perf_counter() - self.started
+        return {"requests": self.requests,
+                "throughput_rps": self.requests / elapsed if elapsed else 0.0,
+                "p50_us": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "p99_us": float(np.percentile(latencies, 99)) if len(latencies) else None,
+                "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else None}
+
+
+class ScoringService:
+    """model: a CLTVModel; customers: a table with Customer ID, recency, T,
+    frequency and monetary in the weekly units of cltv_final (optional)."""
+
+    def __init__(self, model, customers=None, month=3, max_batch=1024, max_delay=0.0002, cache=None, cuts=None):
+        self.model = model
+        self.cache = cache
+        self.month = month
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.stats = LatencyStats()
+        # cuts: frozen segmentation.SegmentCuts; otherwise the known customers' quartiles
+        self.cut_points = cuts.cut_points if cuts is not None else None
+        self.known = {}
+        self._queue = None
+        if customers is not None:
+            self._score_known(customers)
+
+    def _score_known(self, customers):
+        customers = customers.reset_index() if "Customer ID" not in customers.columns else customers
+        scores = self.score_batch(*(customers[col].to_numpy(dtype="float64") for col in PROFILE_FIELDS))
+        # frozen quartile cut points of the known customers' CLV, as pd.qcut would give
+        if self.cut_points is None:
+            self.cut_points = np.quantile(scores["clv"], [0.25, 0.5, 0.75])
+        segments = self.segment(scores["clv"])
+        for i, customer_id in enumerate(customers["Customer ID"].to_numpy()):
+            self.known[int(customer_id)] = {"customer_id": int(customer_id),
+                                            "clv": float(scores["clv"][i]),
+                                            "expected_average_profit": float(scores["expected_average_profit"][i]),
+                                            "segment": segments[i]}
+
+    def segment(self, clv):
+        if self.cut_points is None:
+            return [None] * len(clv)
+        clv = np.asarray(clv, dtype="float64")
+        codes = np.where(np.isnan(clv), -1, np.searchsorted(self.cut_points, clv, side="left"))
+        return [SEGMENT_LABELS[code] if code >= 0 else None for code in codes]
+
+    def score_batch(self, frequency, recency, T, monetary):
+        return score_profiles(self.model, frequency, recency, T, monetary, self.month, cache=self.cache)
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0 and self._queue.empty():
+                    break
+                try:
+                    batch.append(self._queue.get_nowait() if timeout <= 0 else
+                                 await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            profiles = np.array([profile for profile, _ in batch], dtype="float64")
+            try:
+                scores = self.score_batch(*profiles.T)
+                segments = self.segment(scores["clv"])
+                for i, (_, future) in enumerate(batch):
+                    future.set_result({"clv": float(scores["clv"][i]),
+                                       "expected_average_profit": float(scores["expected_average_profit"][i]),
+                                       "segment": segments[i]})
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+            self.stats.batch_sizes.append(len(batch))
+
+    async def handle(self, request):
+        if not isinstance(request, dict):
+            return {"error": "expected a JSON object"}
+        if request.get("op") == "stats":
+            summary = self.stats.summary()
+            if self.cache is not None:
+                summary["cache"] = self.cache.stats()
+            return summary
+        if "customer_id" in request:
+            try:
+                customer_id = int(request["customer_id"])
+            except (TypeError, ValueError, OverflowError):
+                return {"error": "customer_id must be a number"}
+            result = self.known.get(customer_id)
+            return result if result is not None else {"error": "unknown customer_id"}
+        try:
+            profile = [float(request[field]) for field in PROFILE_FIELDS]
+        except (KeyError, TypeError, ValueError):
+            return {"error": f"expected customer_id or {', '.join(PROFILE_FIELDS)}"}
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((profile, future))
+        return await future
+
+    async def _serve_client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                started = time.perf_counter()
+                try:
+                    response = await self.handle(json.loads(line))
+                except json.JSONDecodeError:
+                    response = {"error": "invalid JSON"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                self.stats.record(time.perf_counter() - started)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, unix_path=None):
+        self._queue = asyncio.Queue()
+        batcher = asyncio.create_task(self._batcher())
+        if unix_path:
+            server = await asyncio.start_unix_server(self._serve_client, path=unix_path)
+        else:
+            server = await asyncio.start_server(self._serve_client, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def read_table(path):
+    return pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve CLTV scores from a saved model.")
+    parser.add_argument("--model", required=True, help="model JSON saved by create_cltv_p(model_path=...)")
+    parser.add_argument("--customers", help="Parquet/CSV with Customer ID, recency, T, frequency, monetary (weeks)")
+    parser.add_argument("--month", type=int, default=3)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="serve on this Unix socket path instead of TCP")
+    parser.add_argument("--max-batch", type=int, default=1024)
+    parser.add_argument("--max-delay-us", type=float, default=200.0)
+    parser.add_argument("--cache-size", type=int, default=0, help="memoize up to this many scored profiles")
+    parser.add_argument("--cache-file", help="SQLite file backing the prediction cache across restarts")
+    parser.add_argument("--segment-cuts", help="segment with the cut points saved in this JSON file")
+    args = parser.parse_args(argv)
+
+    cache = None
+    if args.cache_size or args.cache_file:
+        from prediction_cache import PredictionCache
+
+        cache = PredictionCache(args.cache_size or 1_000_000, args.cache_file)
+    cuts = None
+    if args.segment_cuts:
+        from segmentation import load_cuts
+
+        cuts = load_cuts(args.segment_cuts)
+    customers = read_table(args.customers) if args.customers else None
+    service = ScoringService(load_model(args.model), customers, args.month,
+                             args.max_batch, args.max_delay_us / 1e6, cache, cuts)
+    asyncio.run(service.serve(args.host, args.port, args.unix))
+
+
+if __name__ == "__main__":
+    main()
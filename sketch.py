@@ -0,0 +1,86 @@
+##############################################################
+# Mergeable approximate quantile sketch (KLL)
+##############################################################
+
+# Karnin, Lang & Liberty, "Optimal Quantile Approximation in Streams" (2016).
+# Items live in levels; an item on level h stands for 2 ** h inputs. When a level
+# overflows it is sorted and every other item (random offset) is promoted, so the
+# sketch keeps about 3k items whatever the stream length. Two sketches built on
+# different chunks or workers merge by concatenating level by level.
+
+import numpy as np
+
+
+class KLLSketch:
+    """Approximate quantiles with normalized rank error of about 3.3 / k."""
+
+    def __init__(self, k=2000, c=2 / 3, seed=None):
+        self.k = k
+        self.c = c
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_error(cls, rank_error, seed=None):
+        return cls(k=max(8, int(np.ceil(3.3 / rank_error))), seed=seed)
+
+    def __len__(self):
+        return self.n
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * self.c ** depth)))
+
+    def _compress(self):
+        compacted = True
+        while compacted:
+            compacted = False
+            for level in range(len(self.levels)):
+                items = self.levels[level]
+                if len(items) <= self._capacity(level):
+                    continue
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # an odd item out stays behind so the total weight is preserved
+                if len(items) % 2:
+                    self.levels[level], items = items[-1:], items[:-1]
+                else:
+                    self.levels[level] = np.empty(0)
+                offset = self._rng.integers(2)
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], items[offset::2]])
+                compacted = True
+
+    def update(self, values):
+        values = np.asarray(values, dtype="float64").ravel()
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self.n += len(values)
+            self._compress()
+        return self
+
+    def merge(self, other):
+        if other.k != self.k:
+            raise ValueError("cannot merge sketches with different k")
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        if self.n == 0:
+            return np.nan
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_items), 2 ** level, dtype="float64")
+                                  for level, level_items in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        items, cum_weights = items[order], np.cumsum(weights[order])
+        ranks = np.atleast_1d(np.asarray(q, dtype="float64")) * cum_weights[-1]
+        idx = np.minimum(np.searchsorted(cum_weights, ranks, side="left"), len(items) - 1)
+        result = items[idx]
+        return result if np.ndim(q) else float(result[0])
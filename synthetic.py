@@ -0,0 +1,213 @@
+##############################################################
+# Synthetic online_retail_II transactions
+##############################################################
+
+# Samples customers from the BG/NBD and Gamma-Gamma processes the pipeline fits
+# and writes them in the online_retail_II layout, so create_cltv_p can be timed
+# at any size and the fitted parameters can be checked against the true ones.
+#
+#   purchase rate    lambda ~ Gamma(r, scale=1/alpha)   (per day)
+#   dropout prob.    p      ~ Beta(a, b)                (after every repeat purchase)
+#   spend rate       nu     ~ Gamma(q, scale=1/v)
+#   invoice value    z      ~ Gamma(p_gg, scale=1/nu)
+#
+# Every invoice is split over a few catalogue lines (StockCode, Price) whose
+# Quantity x Price add up to about z. A share of the customers check out as
+# guests (no Customer ID) and a share of the lines are cancelled with a
+# "C"-prefixed invoice, as in the workbook.
+
+import numpy as np
+import pandas as pd
+
+TRANSACTION_COLUMNS = ["Invoice", "StockCode", "Quantity", "InvoiceDate", "Price", "Customer ID", "Country"]
+BGNBD_PARAMS = {"r": 0.5, "alpha": 30.0, "a": 0.6, "b": 3.0}
+GAMMA_GAMMA_PARAMS = {"p": 4.0, "q": 4.0, "v": 300.0}
+COUNTRIES = {"United Kingdom": 0.9, "Germany": 0.025, "France": 0.02, "EIRE": 0.02,
+             "Netherlands": 0.01, "Spain": 0.01, "Belgium": 0.01, "Switzerland": 0.005}
+FIRST_INVOICE = 489434
+FIRST_CUSTOMER = 12346
+
+
+def _catalogue(n_items, rng):
+    # Zipf-like popularity, log-normal unit prices
+    popularity = 1 / np.arange(1, n_items + 1) ** 0.8
+    stock_codes = np.array([str(code) for code in 20000 + rng.permutation(80000)[:n_items]], dtype=object)
+    prices = np.round(np.exp(rng.normal(0.8, 0.9, n_items)), 2).clip(0.01)
+    return stock_codes, prices, popularity / popularity.sum()
+
+
+def _repeat_purchase_times(lam, p, T, rng):
+    """Repeat purchase times of every customer, in days after their first purchase.
+
+    The number of purchases in (0, T] is Poisson(lam * T) and, given that number,
+    their times are sorted uniforms. The customer drops out after a Geometric(p)
+    number of repeat purchases, so only the first min(N, M) of them are kept; their
+    times are S_j / S_{N+1} * T with S the cumulative sums of unit exponentials.
+    """
+    n = rng.poisson(lam * T)
+    kept = np.minimum(n, rng.geometric(p))
+    owner = np.repeat(np.arange(len(T)), kept)
+    ends = np.cumsum(kept)
+    partial = np.cumsum(rng.standard_exponential(ends[-1] if len(ends) else 0))
+    # per-customer cumulative sums out of the global one
+    partial -= np.repeat(np.r_[0.0, partial][ends - kept], kept)
+    total = np.ones(len(T))
+    has = kept > 0
+    total[has] = partial[ends[has] - 1] + rng.standard_gamma(n[has] - kept[has] + 1)
+    return owner, partial / np.repeat(total, kept) * T[owner]
+
+
+def _customer_block(n_customers, first_customer, first_invoice, start, days, catalogue, lines_per_invoice,
+                    guest_rate, cancel_rate, bgnbd_params, gamma_gamma_params, rng):
+    stock_codes, prices, popularity = catalogue
+    r, alpha, a, b = (bgnbd_params[name] for name in ("r", "alpha", "a", "b"))
+    p_gg, q, v = (gamma_gamma_params[name] for name in ("p", "q", "v"))
+
+    lam = rng.gamma(r, 1 / alpha, n_customers)
+    p = rng.beta(a, b, n_customers)
+    nu = rng.gamma(q, 1 / v, n_customers)
+    birth = rng.uniform(0, days, n_customers)
+    T = days - birth
+
+    owner, times = _repeat_purchase_times(lam, p, T, rng)
+    # first purchase of every customer followed by the repeats
+    customer = np.r_[np.arange(n_customers), owner]
+    day = np.r_[birth, birth[owner] + times]
+    order = np.argsort(day, kind="stable")
+    customer, day = customer[order], day[order]
+    n_invoices = len(customer)
+    value = rng.gamma(p_gg, 1 / nu[customer])
+
+    # lines of every invoice, value split by exponential weights
+    n_lines = 1 + rng.poisson(lines_per_invoice - 1, n_invoices)
+    line_invoice = np.repeat(np.arange(n_invoices), n_lines)
+    item = rng.choice(len(stock_codes), size=len(line_invoice), p=popularity)
+    weights = rng.standard_exponential(len(line_invoice))
+    weights /= np.add.reduceat(weights, np.cumsum(n_lines) - n_lines)[line_invoice]
+    quantity = np.maximum(1, np.rint(weights * value[line_invoice] / prices[item])).astype("int64")
+
+    customer_ids = (first_customer + customer[line_invoice]).astype("float64")
+    guest = rng.random(n_customers) < guest_rate
+    customer_ids[guest[customer[line_invoice]]] = np.nan
+    countries = np.array(list(COUNTRIES), dtype=object)
+    country = countries[rng.choice(len(countries), size=n_customers, p=list(COUNTRIES.values()))]
+
+    # minute resolution, shop hours
+    minutes = np.floor(day) * 1440 + 7 * 60 + np.floor((day % 1) * 12 * 60)
+    invoice_dates = start + pd.to_timedelta(minutes[line_invoice], unit="min")
+    invoices = (first_invoice + line_invoice).astype(str).astype(object)
+
+    frame = pd.DataFrame({"Invoice": invoices,
+                          "StockCode": stock_codes[item],
+                          "Quantity": quantity,
+                          "InvoiceDate": invoice_dates,
+                          "Price": prices[item],
+                          "Customer ID": customer_ids,
+                          "Country": country[customer[line_invoice]]})
+
+    # cancellations: a copy of the line with negative Quantity on a "C" invoice
+    cancelled = np.flatnonzero(rng.random(len(frame)) < cancel_rate)
+    if len(cancelled):
+        cancellations = frame.iloc[cancelled].copy()
+        cancellations["Invoice"] = "C" + cancellations["Invoice"]
+        cancellations["Quantity"] = -cancellations["Quantity"]
+        cancellations["InvoiceDate"] = cancellations["InvoiceDate"] + pd.Timedelta(hours=1)
+        frame = pd.concat([frame, cancellations], ignore_index=True)
+    line_customer = customer[line_invoice]
+    return frame, n_invoices, np.r_[line_customer, line_customer[cancelled]]
+
+
+def iter_synthetic_transactions(n_lines, seed=0, chunk_lines=1_000_000, start="2009-12-01", days=739,
+                                lines_per_invoice=20, n_items=4000, guest_rate=0.2, cancel_rate=0.02,
+                                bgnbd_params=BGNBD_PARAMS, gamma_gamma_params=GAMMA_GAMMA_PARAMS):
+    """Yield DataFrame chunks of at most chunk_lines rows, about n_lines rows in total.
+
+    Chunks hold disjoint blocks of whole customers (every customer keeps its full
+    history up to the end of the window), so a chunk can fall short of
+    chunk_lines by less than one customer's lines. Rows are sorted by InvoiceDate
+    within a chunk only, so any number of lines is generated in constant memory.
+    bgnbd_params are per day, like the recency and T of rfm_summary.
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(start)
+    catalogue = _catalogue(n_items, rng)
+    # first estimate of the lines per customer; corrected from every block
+    lines_per_customer = lines_per_invoice * 3.0
+    first_customer, first_invoice, remaining = FIRST_CUSTOMER, FIRST_INVOICE, n_lines
+    while remaining > 0:
+        target = min(chunk_lines, remaining)
+        parts, size = [], 0
+        while size < target:
+            # aim a little high, then keep the customers that fit
+            n_customers = max(int(1.1 * (target - size) / lines_per_customer), 1)
+            frame, n_invoices, line_customer = _customer_block(n_customers, first_customer, first_invoice, start,
+                                                               days, catalogue, lines_per_invoice, guest_rate,
+                                                               cancel_rate, bgnbd_params, gamma_gamma_params, rng)
+            lines_per_customer = max(len(frame) / n_customers, 1.0)
+            counts = np.bincount(line_customer, minlength=n_customers)
+            n_kept = int(np.searchsorted(np.cumsum(counts), target - size, side="right"))
+            if n_kept < n_customers:
+                frame = frame[line_customer < n_kept]
+            # dropped customers' IDs are reused by the next block, their invoice numbers are not
+            first_customer += n_kept
+            first_invoice += n_invoices
+            parts.append(frame)
+            size += len(frame)
+            if n_kept < n_customers:
+                break
+        remaining -= target
+        if size == 0:
+            # not even one more customer fits
+            break
+        yield pd.concat(parts).sort_values("InvoiceDate", kind="stable").reset_index(drop=True)
+
+
+def synthetic_profiles(n_customers, seed=0, days=739, bgnbd_params=BGNBD_PARAMS,
+                       gamma_gamma_params=GAMMA_GAMMA_PARAMS):
+    """Customer summaries drawn from the same processes without the transactions, in
+    the weekly units of cltv.weekly_summary: frequency (invoices, first one included),
+    recency, T and monetary (mean invoice value). The last kept repeat purchase is
+    the kept-th of the Poisson(lam * T) uniform times, hence T * Beta(kept, n - kept + 1)."""
+    rng = np.random.default_rng(seed)
+    r, alpha, a, b = (bgnbd_params[name] for name in ("r", "alpha", "a", "b"))
+    p_gg, q, v = (gamma_gamma_params[name] for name in ("p", "q", "v"))
+    lam = rng.gamma(r, 1 / alpha, n_customers)
+    T = rng.uniform(0, days, n_customers)
+    n = rng.poisson(lam * T)
+    kept = np.minimum(n, rng.geometric(rng.beta(a, b, n_customers)))
+    recency = np.zeros(n_customers)
+    has = kept > 0
+    recency[has] = T[has] * rng.beta(kept[has], n[has] - kept[has] + 1)
+    frequency = kept + 1
+    monetary = rng.gamma(p_gg * frequency, 1 / rng.gamma(q, 1 / v, n_customers)) / frequency
+    return {"frequency": frequency.astype("float64"), "recency": recency / 7, "T": T / 7, "monetary": monetary}
+
+
+def synthetic_transactions(n_lines, seed=0, **kwargs):
+    """All n_lines rows in one frame; see iter_synthetic_transactions."""
+    return pd.concat(iter_synthetic_transactions(n_lines, seed, **kwargs), ignore_index=True)
+
+
+def write_synthetic_transactions(path, n_lines, seed=0, **kwargs):
+    """Write n_lines synthetic rows to a .parquet or .csv file, chunk by chunk."""
+    if path.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in iter_synthetic_transactions(n_lines, seed, **kwargs):
+                table = pa.Table.from_pandas(chunk.astype({"Invoice": "string", "StockCode": "string",
+                                                           "Country": "string"}), preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+    elif path.endswith(".csv"):
+        for i, chunk in enumerate(iter_synthetic_transactions(n_lines, seed, **kwargs)):
+            chunk.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    else:
+        raise ValueError(f"unsupported transaction file: {path}")
+    return path
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from scipy.optimize import check_grad
+
+from bgnbd import BGNBDFitter, PARAM_NAMES, negative_log_likelihood
+
+lifetimes = pytest.importorskip("lifetimes")
+from lifetimes.datasets import load_cdnow_summary  # noqa: E402
+
+PENALIZER = 0.001
+
+
+@pytest.fixture(scope="module")
+def summary():
+    return load_cdnow_summary(index_col=[0])
+
+
+@pytest.fixture(scope="module")
+def fitted(summary):
+    ours = BGNBDFitter(penalizer_coef=PENALIZER).fit(summary["frequency"], summary["recency"], summary["T"])
+    theirs = lifetimes.BetaGeoFitter(penalizer_coef=PENALIZER).fit(summary["frequency"], summary["recency"],
+                                                                   summary["T"])
+    return ours, theirs
+
+
+def test_params_match_lifetimes(fitted):
+    ours, theirs = fitted
+    np.testing.assert_allclose(ours.params_[PARAM_NAMES].to_numpy(), theirs.params_[PARAM_NAMES].to_numpy(),
+                               rtol=1e-5)
+
+
+def test_predictions_match_lifetimes(fitted, summary):
+    ours, theirs = fitted
+    for t in (1, 4, 12):
+        expected = theirs.predict(t, summary["frequency"], summary["recency"], summary["T"])
+        result = ours.predict(t, summary["frequency"], summary["recency"], summary["T"])
+        np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), rtol=1e-5, atol=1e-10)
+
+
+def test_gradient_matches_finite_differences(summary):
+    freq = summary["frequency"].to_numpy()
+    scale = 1.0 / summary["T"].max()
+    rec = summary["recency"].to_numpy() * scale
+    T = summary["T"].to_numpy() * scale
+    weights = np.ones_like(rec)
+    args = (freq, rec, T, weights, PENALIZER)
+    for log_params in (0.1 * np.ones(4), np.log([0.25, 0.5, 0.8, 2.5])):
+        error = check_grad(lambda x: negative_log_likelihood(x, *args)[0],
+                           lambda x: negative_log_likelihood(x, *args)[1], log_params)
+        assert error < 1e-5
+
+
+def test_warm_start_needs_fewer_iterations(fitted, summary):
+    cold, _ = fitted
+    warm = BGNBDFitter(penalizer_coef=PENALIZER).fit(summary["frequency"], summary["recency"], summary["T"],
+                                                     initial_params=cold.params_[PARAM_NAMES].to_numpy())
+    assert warm.n_iter_ < cold.n_iter_
+    np.testing.assert_allclose(warm.params_.to_numpy(), cold.params_.to_numpy(), rtol=1e-5)
@@ -0,0 +1,63 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+from rfm import rfm_summary
+
+TODAY = dt.datetime(2011, 12, 11)
+
+
+def lambda_summary(df, today_date):
+    # the groupby / agg the walkthrough used before rfm_summary
+    cltv_df = df.groupby('Customer ID').agg({'InvoiceDate': [lambda date: (date.max() - date.min()).days,
+                                                             lambda date: (today_date - date.min()).days],
+                                             'Invoice': lambda num: num.nunique(),
+                                             'TotalPrice': lambda TotalPrice: TotalPrice.sum()})
+    cltv_df.columns = cltv_df.columns.droplevel(0)
+    cltv_df.columns = ['recency', 'T', 'frequency', 'monetary']
+    return cltv_df
+
+
+def transactions():
+    rows = [
+        # multi-line invoices
+        ("489434", 12346.0, "2010-01-10 09:00", 2, 1.5),
+        ("489434", 12346.0, "2010-01-10 09:00", 3, 2.0),
+        ("489435", 12346.0, "2010-06-01 17:30", 1, 10.0),
+        ("C489436", 12346.0, "2010-06-02 08:00", -1, 10.0),
+        ("489437", 12347.0, "2011-03-05 23:59", 4, 0.25),
+        ("489437", 12347.0, "2011-03-05 23:59", 1, 3.0),
+        ("C489438", 12347.0, "2011-03-06 00:01", -4, 0.25),
+        # missing customers
+        ("489439", np.nan, "2011-04-01 12:00", 5, 1.0),
+        ("489440", np.nan, "2011-04-02 12:00", 1, 2.0),
+        # one-invoice customer
+        ("489441", 12348.0, "2011-12-09 12:50", 6, 2.1),
+        ("489442", 12349.0, "2009-12-01 07:45", 10, 0.85),
+        ("489443", 12349.0, "2011-11-30 13:00", 12, 1.25),
+        ("489443", 12349.0, "2011-11-30 13:00", 1, 7.95),
+    ]
+    df = pd.DataFrame(rows, columns=["Invoice", "Customer ID", "InvoiceDate", "Quantity", "Price"])
+    df["InvoiceDate"] = pd.to_datetime(df["InvoiceDate"])
+    df["TotalPrice"] = df["Quantity"] * df["Price"]
+    return df
+
+
+def test_rfm_summary_matches_lambda_groupby():
+    df = transactions()
+    expected = lambda_summary(df, TODAY)
+    result = rfm_summary(df, TODAY)
+
+    assert list(result.columns) == ['recency', 'T', 'frequency', 'monetary']
+    np.testing.assert_array_equal(result.index.to_numpy(), expected.index.to_numpy())
+    for col in ['recency', 'T', 'frequency']:
+        np.testing.assert_array_equal(result[col].to_numpy(), expected[col].to_numpy())
+    np.testing.assert_allclose(result["monetary"].to_numpy(), expected["monetary"].to_numpy(), rtol=1e-12)
+
+
+def test_rfm_summary_does_not_modify_input():
+    df = transactions()
+    before = df.copy()
+    rfm_summary(df, TODAY)
+    pd.testing.assert_frame_equal(df, before)